@@ -0,0 +1,80 @@
+"""
+Compare request latency of score_automl without explanations, with
+lightgbm's native pred_contrib explanations and, given a pickled scoring
+explainer, with the scoring explainer. The model is a lightgbm model
+trained on synthetic features unless --model_path points to a pickle.
+Run from the repo root:
+    python benchmarks/bench_automl_explain.py --rows 1 100 1000
+"""
+import os
+import sys
+import argparse
+import joblib
+
+sys.path.append(os.path.join(os.getcwd(), 'code'))
+import model_io  # noqa: E402
+from bench_utils import (  # noqa: E402
+    synthetic_features, timed, train_synthetic_model)
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument(
+        '--model_path',
+        type=str,
+        default=None,
+        dest='model_path',
+        help='pickled automl or lightgbm model')
+    parser.add_argument(
+        '--scoring_explainer_path',
+        type=str,
+        default=None,
+        dest='scoring_explainer_path',
+        help='pickled scoring explainer of the model')
+    parser.add_argument(
+        '--rows',
+        type=int,
+        nargs='+',
+        default=[1, 100, 1000],
+        dest='rows',
+        help='rows per request')
+    parser.add_argument(
+        '--num_boost_round',
+        type=int,
+        default=200,
+        dest='num_boost_round',
+        help='boosting rounds of the synthetic model')
+    parser.add_argument(
+        '--repeat',
+        type=int,
+        default=10,
+        dest='repeat',
+        help='number of timed runs, the best one is reported')
+    args = parser.parse_args()
+
+    if args.model_path is None:
+        model = train_synthetic_model(args.num_boost_round)
+    else:
+        model = joblib.load(args.model_path)
+    scorers = [('predict only', model.predict)]
+    native = model_io.native_explainer(model)
+    if native is not None:
+        scorers.append(('predict and pred_contrib',
+                        lambda data: (model.predict(data), native(data))))
+    if args.scoring_explainer_path is not None:
+        scoring_explainer = joblib.load(args.scoring_explainer_path)
+        scorers.append(
+            ('predict and scoring explainer',
+             lambda data: (model.predict(data),
+                           scoring_explainer.explain(data))))
+
+    for n_rows in args.rows:
+        data = synthetic_features(n_rows, seed=1)
+        for name, score in scorers:
+            _, seconds = timed(lambda: score(data), args.repeat)
+            print('{:>6} rows: {:<30} {:.3f} ms'.format(
+                n_rows, name, seconds * 1000))
+
+
+if __name__ == '__main__':
+    main()
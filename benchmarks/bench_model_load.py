@@ -0,0 +1,100 @@
+"""
+Compare scoring service cold start with the model loaders of model_io:
+the pickled Booster, lightgbm's text model format and, if treelite is
+installed, the compiled shared library. Every loader runs in a fresh
+python process, which reports import plus load time and peak RSS.
+Run from the repo root:
+    python benchmarks/bench_model_load.py --model_folder outputs/model
+Without --model_folder, a model is trained on synthetic data first.
+"""
+import os
+import sys
+import json
+import argparse
+import tempfile
+import subprocess
+
+sys.path.append(os.path.join(os.getcwd(), 'code'))
+import consts  # noqa: E402
+import model_io  # noqa: E402
+from bench_utils import train_synthetic_model  # noqa: E402
+
+LOADER_SCRIPT = '''
+import sys
+import time
+import json
+import resource
+start = time.perf_counter()
+sys.path.append({code_path!r})
+import model_io
+loaded = time.perf_counter()
+model = model_io.load_model({model_path!r}, use_compiled={use_compiled})
+model.predict([[1, 1, 1.0, -73.96, 40.67, -73.95, 40.66, 8.15, 1, 17, 5, 1]])
+print(json.dumps({{
+    'seconds': time.perf_counter() - start,
+    'load_seconds': time.perf_counter() - loaded,
+    'peak_rss_mb': resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024,
+    'model': type(model).__name__}}))
+'''
+
+
+def export_synthetic_model(model_folder, num_boost_round, compile_model):
+    model = train_synthetic_model(num_boost_round, num_leaves=255)
+    model_io.export_model(model, model_folder, compile_model=compile_model)
+
+
+def cold_start(model_path, use_compiled, repeat):
+    script = LOADER_SCRIPT.format(
+        code_path=os.path.join(os.getcwd(), 'code'),
+        model_path=model_path, use_compiled=use_compiled)
+    runs = [json.loads(subprocess.check_output(
+                [sys.executable, '-c', script]).decode('utf-8'))
+            for _ in range(repeat)]
+    best = min(runs, key=lambda result: result['seconds'])
+    return best
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument(
+        '--model_folder',
+        type=str,
+        default=None,
+        dest='model_folder',
+        help='folder with the model files written by train.py')
+    parser.add_argument(
+        '--num_boost_round',
+        type=int,
+        default=500,
+        dest='num_boost_round',
+        help='boosting rounds of the synthetic model')
+    parser.add_argument(
+        '--repeat',
+        type=int,
+        default=3,
+        dest='repeat',
+        help='number of cold starts per loader, the best one is reported')
+    args = parser.parse_args()
+
+    model_folder = args.model_folder
+    if model_folder is None:
+        model_folder = tempfile.mkdtemp(prefix='bench_model_')
+        export_synthetic_model(model_folder, args.num_boost_round,
+                               compile_model=True)
+
+    loaders = [
+        ('pickle', os.path.join(model_folder, consts.model_name), False),
+        ('native', model_folder, False)]
+    if os.path.isfile(os.path.join(model_folder,
+                                   consts.model_compiled_file_name)):
+        loaders.append(('compiled', model_folder, True))
+    for name, model_path, use_compiled in loaders:
+        result = cold_start(model_path, use_compiled, args.repeat)
+        print('{:<9} {:<14} cold start {:.3f}s (load and first predict '
+              '{:.3f}s), peak rss {:.0f} MB'.format(
+                  name, result['model'], result['seconds'],
+                  result['load_seconds'], result['peak_rss_mb']))
+
+
+if __name__ == '__main__':
+    main()
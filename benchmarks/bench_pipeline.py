@@ -0,0 +1,230 @@
+"""
+Benchmark the pipeline on generated raw green taxi data: read_raw_data,
+process_raw_data, read_train_data, train_model and score.run, in rows
+per second. Results are saved as json, and compared with a baseline run
+to flag the benchmarks that got slower than the threshold.
+Run from the repo root:
+    python benchmarks/bench_pipeline.py --rows 1000000 \
+        --output bench_results.json
+    python benchmarks/bench_pipeline.py --rows 1000000 \
+        --baseline bench_results.json --threshold 0.1
+The raw data is generated once per size and reused. Reading and
+processing hold all rows in memory, about 40 bytes per raw row.
+score.run needs inference_schema and uses the stand-ins of
+code/local_server.py for azureml.
+"""
+import os
+import sys
+import json
+import time
+import shutil
+import platform
+import argparse
+import tempfile
+import numpy as np
+
+sys.path.append(os.path.join(os.getcwd(), 'code'))
+import local_server  # noqa: E402
+
+try:
+    import azureml.core  # noqa: F401
+except ImportError:
+    local_server.install_azureml_stand_ins({}, None, None)
+import utils  # noqa: E402
+import train  # noqa: E402
+import model_io  # noqa: E402
+from generate_raw_data import generate_raw_files  # noqa: E402
+from bench_utils import timed  # noqa: E402
+
+benchmark_names = [
+    'read_raw_data', 'process_raw_data', 'read_train_data', 'train_model',
+    'score_run']
+
+
+def result_of(rows, seconds):
+    return {'rows': rows, 'seconds': seconds,
+            'rows_per_second': rows / seconds}
+
+
+def bench_score_run(model_folder, rows, batch_rows, n_requests):
+    """
+    Time score.run over requests of batch_rows processed rows, the way
+    the inference server calls it.
+    """
+    local_server.install_azureml_stand_ins({}, model_folder, None)
+    entry_script = local_server.load_entry_script(
+        os.path.join('code', 'score.py'))
+    bodies = [json.dumps({'data': rows[start:start + batch_rows].tolist()})
+              for start in range(0, batch_rows * n_requests, batch_rows)
+              if start + batch_rows <= len(rows)]
+    start = time.perf_counter()
+    for body in bodies:
+        local_server.invoke(entry_script.run, body)
+    return result_of(len(bodies) * batch_rows, time.perf_counter() - start)
+
+
+def run_benchmarks(raw_folder, work_folder, names, repeat, score_batch_rows,
+                   score_requests):
+    results = {}
+    df, seconds = timed(lambda: utils.read_raw_data(
+        raw_folder, usecols=utils.raw_columns_used), repeat)
+    results['read_raw_data'] = result_of(len(df), seconds)
+
+    processed, seconds = timed(lambda: utils.process_raw_data(df), repeat)
+    results['process_raw_data'] = result_of(len(df), seconds)
+    df = None
+
+    train_folder = os.path.join(work_folder, 'train')
+    utils.write_train_data(processed, train_folder, 'train.csv')
+    if 'read_train_data' in names:
+        train_df, seconds = timed(
+            lambda: utils.read_train_data(train_folder), repeat)
+        results['read_train_data'] = result_of(len(train_df), seconds)
+        del train_df
+
+    model_folder = os.path.join(work_folder, 'model')
+    if 'train_model' in names or 'score_run' in names:
+        def train_on_processed():
+            x, y, feature_names, train_idx, test_idx = train.split_data(
+                processed)
+            dataset = train.build_dataset(x, y, feature_names)
+            return train.train_model(dataset, x, y, train_idx, test_idx)[0]
+        model, seconds = timed(train_on_processed, repeat)
+        results['train_model'] = result_of(int(len(processed) * 0.8),
+                                           seconds)
+        model_io.export_model(model, model_folder)
+
+    if 'score_run' in names:
+        try:
+            import inference_schema  # noqa: F401
+        except ImportError:
+            print('inference_schema is not installed, skip score_run')
+        else:
+            rows = processed[utils.feature_columns].values.astype(np.float64)
+            results['score_run'] = bench_score_run(
+                model_folder, rows, score_batch_rows, score_requests)
+    return {name: result for name, result in results.items()
+            if name in names}
+
+
+def compare_with_baseline(results, baseline, threshold):
+    """
+    Return the benchmarks whose rows per second dropped by more than
+    threshold, as a fraction, from the baseline.
+    """
+    regressions = []
+    for name, result in results.items():
+        if name not in baseline:
+            continue
+        ratio = result['rows_per_second'] / \
+            baseline[name]['rows_per_second']
+        print('{:<17} {:>14,.0f} rows/s  baseline {:>14,.0f}  {:+.1%}'.format(
+            name, result['rows_per_second'],
+            baseline[name]['rows_per_second'], ratio - 1))
+        if ratio < 1 - threshold:
+            regressions.append(name)
+    return regressions
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument(
+        '--rows',
+        type=int,
+        default=100000,
+        dest='rows',
+        help='number of generated raw trips, 1e5 to 1e8')
+    parser.add_argument(
+        '--raw_folder',
+        type=str,
+        default=None,
+        dest='raw_folder',
+        help='folder of the generated raw data, reused across runs, '
+             'defaults to a folder per size in the temp directory')
+    parser.add_argument(
+        '--benchmarks',
+        type=str,
+        nargs='+',
+        default=benchmark_names,
+        choices=benchmark_names,
+        dest='benchmarks',
+        help='benchmarks to run')
+    parser.add_argument(
+        '--repeat',
+        type=int,
+        default=1,
+        dest='repeat',
+        help='number of timed runs, the best one is reported')
+    parser.add_argument(
+        '--score_batch_rows',
+        type=int,
+        default=100,
+        dest='score_batch_rows',
+        help='rows per score.run request')
+    parser.add_argument(
+        '--score_requests',
+        type=int,
+        default=200,
+        dest='score_requests',
+        help='number of score.run requests')
+    parser.add_argument(
+        '--output',
+        type=str,
+        default=None,
+        dest='output',
+        help='json file to save the results to')
+    parser.add_argument(
+        '--baseline',
+        type=str,
+        default=None,
+        dest='baseline',
+        help='json file with the results to compare with')
+    parser.add_argument(
+        '--threshold',
+        type=float,
+        default=0.1,
+        dest='threshold',
+        help='fraction of rows per second a benchmark may lose against '
+             'the baseline before it is a regression')
+    args = parser.parse_args()
+
+    raw_folder = args.raw_folder or os.path.join(
+        tempfile.gettempdir(), 'nyc_taxi_raw_{}'.format(args.rows))
+    generate_raw_files(raw_folder, args.rows)
+    work_folder = tempfile.mkdtemp(prefix='bench_pipeline_')
+    try:
+        results = run_benchmarks(raw_folder, work_folder, args.benchmarks,
+                                 args.repeat, args.score_batch_rows,
+                                 args.score_requests)
+    finally:
+        shutil.rmtree(work_folder, ignore_errors=True)
+
+    report = {
+        'rows': args.rows,
+        'python': platform.python_version(),
+        'cpu_count': os.cpu_count(),
+        'results': results}
+    if args.output:
+        with open(args.output, 'w') as f:
+            json.dump(report, f, indent=2)
+
+    if args.baseline is None:
+        for name, result in results.items():
+            print('{:<17} {:>14,.0f} rows/s  {:.3f}s'.format(
+                name, result['rows_per_second'], result['seconds']))
+        return 0
+    with open(args.baseline) as f:
+        baseline = json.load(f)
+    if baseline['rows'] != args.rows:
+        print('baseline has {} rows, this run {}'.format(
+            baseline['rows'], args.rows))
+    regressions = compare_with_baseline(results, baseline['results'],
+                                        args.threshold)
+    for name in regressions:
+        print('regression: {} is more than {:.0%} slower than the '
+              'baseline'.format(name, args.threshold))
+    return 1 if regressions else 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,79 @@
+"""
+Compare rows/second of utils.process_raw_data with the previous
+implementation, which filtered with separate boolean Series, built
+features one .dt accessor at a time and popped unused columns one by one.
+Run from the repo root:
+    python benchmarks/bench_process_raw_data.py --rows 1000000
+"""
+import os
+import sys
+import argparse
+import numpy as np
+import pandas as pd
+
+sys.path.append(os.path.join(os.getcwd(), 'code'))
+import utils  # noqa: E402
+from bench_utils import synthetic_raw_data, timed  # noqa: E402
+
+
+def legacy_process_raw_data(df):
+    df = df.loc[
+            (df.pickupLatitude >= utils.min_latitude) &
+            (df.pickupLatitude <= utils.max_latitude) &
+            (df.pickupLongitude >= utils.min_longitude) &
+            (df.pickupLongitude <= utils.max_longitude) &
+            (df.tripDistance >= utils.min_distance) &
+            (df.tripDistance < utils.max_distance) &
+            (df.passengerCount > 0) &
+            (df.totalAmount > 0)]
+    pd.options.mode.chained_assignment = None
+    df['month_num'] = df.lpepPickupDatetime.dt.month
+    df['day_of_month'] = df.lpepPickupDatetime.dt.day
+    df['day_of_week'] = df.lpepPickupDatetime.dt.weekday
+    df['hour_of_day'] = df.lpepPickupDatetime.dt.hour
+    df['duration'] = (
+        (df.lpepDropoffDatetime - df.lpepPickupDatetime).dt.seconds // 60)
+    df = df.loc[(df.duration < utils.max_duration)]
+    for col in utils.raw_columns_removed:
+        if col in df:
+            df.pop(col)
+    return df
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument(
+        '--rows',
+        type=int,
+        default=1000000,
+        dest='rows',
+        help='number of synthetic raw rows')
+    parser.add_argument(
+        '--repeat',
+        type=int,
+        default=3,
+        dest='repeat',
+        help='number of timed runs, the best one is reported')
+    args = parser.parse_args()
+
+    df = synthetic_raw_data(args.rows)
+    expected = legacy_process_raw_data(df)
+    # the month index for cross validation is new
+    actual = utils.process_raw_data(df).drop(
+        columns=utils.month_index_column)
+    assert expected.index.equals(actual.index), "kept rows should match"
+    assert np.array_equal(expected.values, actual.values), \
+        "processed values should match"
+
+    _, legacy = timed(lambda: legacy_process_raw_data(df), args.repeat)
+    _, fused = timed(lambda: utils.process_raw_data(df), args.repeat)
+    print('rows: {}'.format(args.rows))
+    print('legacy process_raw_data: {:,.0f} rows/s'.format(
+        args.rows / legacy))
+    print('fused process_raw_data:  {:,.0f} rows/s'.format(
+        args.rows / fused))
+    print('speedup: {:.1f}x'.format(legacy / fused))
+
+
+if __name__ == '__main__':
+    main()
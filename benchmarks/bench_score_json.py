@@ -0,0 +1,85 @@
+"""
+Compare decoding a scoring request with the input schema decorator of
+score.py against serving.parse_features_json, which parses the payload
+directly into a float32 array. Without inference_schema installed, the
+decorator is approximated by json.loads and a conversion of the lists.
+Run from the repo root:
+    python benchmarks/bench_score_json.py --rows 1000 5000
+"""
+import os
+import sys
+import json
+import argparse
+import numpy as np
+
+sys.path.append(os.path.join(os.getcwd(), 'code'))
+import serving  # noqa: E402
+from bench_utils import synthetic_features, timed  # noqa: E402
+
+try:
+    from inference_schema.schema_decorators import input_schema
+    from inference_schema.parameter_types.numpy_parameter_type \
+        import NumpyParameterType
+except ImportError:
+    input_schema = None
+
+input_sample = np.array([
+    [1, 1, 1.00, -73.957909, 40.670761,
+     -73.952194, 40.662312, 8.15, 1, 17, 5, 1]])
+
+
+def schema_decoder():
+    if input_schema is None:
+        def decode(raw_data):
+            return np.array(json.loads(raw_data)['data'])
+        return 'json.loads', decode
+
+    @input_schema('data', NumpyParameterType(input_sample))
+    def run(data):
+        return data
+
+    def decode(raw_data):
+        # the scoring server loads the body and passes its keys to run
+        return run(**json.loads(raw_data))
+    return 'input_schema', decode
+
+
+def synthetic_request(n_rows, seed=0):
+    rows = synthetic_features(n_rows, seed).values.astype(np.float64)
+    return json.dumps({'data': np.round(rows, 6).tolist()})
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument(
+        '--rows',
+        type=int,
+        nargs='+',
+        default=[1, 100, 1000, 10000],
+        dest='rows',
+        help='rows per request')
+    parser.add_argument(
+        '--repeat',
+        type=int,
+        default=20,
+        dest='repeat',
+        help='number of timed runs, the best one is reported')
+    args = parser.parse_args()
+
+    name, decode = schema_decoder()
+    for n_rows in args.rows:
+        raw_data = synthetic_request(n_rows)
+        expected = np.asarray(decode(raw_data), dtype=np.float32)
+        assert np.array_equal(
+            expected, serving.parse_features_json(raw_data)), \
+            "both decoders should return the same features"
+        _, baseline = timed(lambda: decode(raw_data), args.repeat)
+        _, fast = timed(lambda: serving.parse_features_json(raw_data),
+                        args.repeat)
+        print('{:>6} rows: {} {:.3f} ms, fast path {:.3f} ms, '
+              'speedup {:.1f}x'.format(n_rows, name, baseline * 1000,
+                                       fast * 1000, baseline / fast))
+
+
+if __name__ == '__main__':
+    main()
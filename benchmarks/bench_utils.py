@@ -0,0 +1,76 @@
+"""
+Synthetic data and timing shared by the benchmarks. All synthetic data
+comes from the raw trips of generate_raw_data.synthetic_raw_trips, so
+every benchmark runs on the same realistic distributions.
+"""
+import os
+import sys
+import time
+import numpy as np
+import pandas as pd
+import lightgbm as lgb
+
+sys.path.append(os.path.join(os.getcwd(), 'code'))
+import utils  # noqa: E402
+from generate_raw_data import synthetic_raw_trips  # noqa: E402
+
+
+def timed(func, repeat):
+    """
+    Call func repeat times, return the result and the best wall time.
+    """
+    best = None
+    for _ in range(repeat):
+        start = time.perf_counter()
+        result = func()
+        elapsed = time.perf_counter() - start
+        best = elapsed if best is None else min(best, elapsed)
+    return result, best
+
+
+def synthetic_raw_data(n_rows, seed=0, usecols=utils.raw_columns_used):
+    """
+    Raw trips as read_raw_data returns them, with the pinned raw schema.
+    """
+    df = synthetic_raw_trips(n_rows, seed)[usecols]
+    for col in utils.raw_datetime_columns:
+        if col in df:
+            df[col] = pd.to_datetime(df[col],
+                                     format=utils.raw_datetime_format)
+    return df.astype({col: dtype for col, dtype in utils.raw_dtypes.items()
+                      if col in df})
+
+
+def synthetic_train_data(n_rows, seed=0):
+    """
+    n_rows of processed training data, the valid trips of a larger
+    synthetic raw sample.
+    """
+    df = utils.process_raw_data(synthetic_raw_data(n_rows * 2 + 100, seed))
+    return df.iloc[:n_rows].reset_index(drop=True)
+
+
+def synthetic_features(n_rows, seed=0):
+    """
+    n_rows of model features as float32, in model order, with dropoffs in
+    the area the scoring service accepts as well.
+    """
+    df = synthetic_train_data(n_rows * 2 + 100, seed)
+    in_area = df.dropoffLongitude.between(
+        utils.min_longitude, utils.max_longitude) & \
+        df.dropoffLatitude.between(utils.min_latitude, utils.max_latitude)
+    return df.loc[in_area, utils.feature_columns].iloc[:n_rows].astype(
+        np.float32).reset_index(drop=True)
+
+
+def train_synthetic_model(num_boost_round, num_leaves=63, n_rows=100000):
+    """
+    Train a lightgbm model of the trip duration on synthetic data.
+    """
+    df = synthetic_train_data(n_rows)
+    dataset = lgb.Dataset(df[utils.feature_columns].values.astype(
+        np.float32), label=df[utils.label_column].values,
+        params={'verbose': -1})
+    return lgb.train({'objective': 'regression', 'num_leaves': num_leaves,
+                      'verbose': -1}, dataset,
+                     num_boost_round=num_boost_round)
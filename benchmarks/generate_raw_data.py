@@ -0,0 +1,183 @@
+"""
+Generate green taxi raw files with the 23 columns and the csv layout of
+tests/unit/test_data/raw/test_data.csv, for benchmarks at 1e5 to 1e8
+rows. Every file is generated from its own seed, so the data only
+depends on the seed and the number of rows per file. About a tenth of
+the trips are outside of the ranges data prep keeps.
+Run from the repo root:
+    python benchmarks/generate_raw_data.py --rows 10000000 \
+        --raw_folder /tmp/raw
+"""
+import os
+import json
+import argparse
+from concurrent.futures import ProcessPoolExecutor
+import numpy as np
+import pandas as pd
+
+raw_columns = [
+    'vendorID', 'lpepPickupDatetime', 'lpepDropoffDatetime',
+    'passengerCount', 'tripDistance', 'puLocationId', 'doLocationId',
+    'pickupLongitude', 'pickupLatitude', 'dropoffLongitude',
+    'dropoffLatitude', 'rateCodeID', 'storeAndFwdFlag', 'paymentType',
+    'fareAmount', 'extra', 'mtaTax', 'improvementSurcharge', 'tipAmount',
+    'tollsAmount', 'ehailFee', 'totalAmount', 'tripType']
+generator_file_name = 'generator.json'
+# trips start in 2015 like the open dataset sample the model is built on
+start_of_year = np.datetime64('2015-01-01T00:00:00', 's')
+
+
+def synthetic_raw_trips(n_rows, seed):
+    """
+    Raw trips as read from the open dataset, with realistic distances,
+    durations and fares and a share of invalid rows.
+    """
+    rng = np.random.RandomState(seed)
+    # most trips in the afternoon, fewest at night
+    hour_weights = 1.2 + np.sin((np.arange(24) - 9) * np.pi / 12)
+    hour = rng.choice(24, n_rows, p=hour_weights / hour_weights.sum())
+    day = rng.randint(0, 365, n_rows)
+    second = rng.randint(0, 3600, n_rows)
+    pickup = start_of_year + (day * 86400 + hour * 3600 + second).astype(
+        'timedelta64[s]')
+    distance = np.round(rng.lognormal(0.7, 0.8, n_rows), 2)
+    minutes = np.maximum(distance * rng.uniform(2, 6, n_rows) +
+                         rng.exponential(3, n_rows), 0.1)
+    # some dropoffs before the pickup or days later
+    minutes[rng.rand(n_rows) < 0.01] *= -1
+    minutes[rng.rand(n_rows) < 0.01] += 60 * 24
+    dropoff = pickup + (minutes * 60).astype('timedelta64[s]')
+    # formatted up front, much faster than letting to_csv do it
+    pickup, dropoff = (
+        np.char.replace(np.datetime_as_string(t, unit='s'), 'T', ' ')
+        for t in (pickup, dropoff))
+
+    pickup_longitude = rng.normal(-73.92, 0.06, n_rows)
+    pickup_latitude = rng.normal(40.74, 0.07, n_rows)
+    bearing = rng.uniform(0, 2 * np.pi, n_rows)
+    # the straight line is about 3/4 of the trip distance, and a mile is
+    # about 0.019 degrees of longitude and 0.0145 degrees of latitude
+    straight = distance * 0.75
+    dropoff_longitude = pickup_longitude + np.cos(bearing) * straight * 0.019
+    dropoff_latitude = pickup_latitude + np.sin(bearing) * straight * 0.0145
+    missing_coordinates = rng.rand(n_rows) < 0.02
+    for coordinate in (pickup_longitude, pickup_latitude,
+                       dropoff_longitude, dropoff_latitude):
+        coordinate[missing_coordinates] = 0.0
+
+    fare = np.round(2.5 + distance * 2.5 + np.abs(minutes) * 0.3, 1)
+    extra = rng.choice([0.0, 0.5, 1.0], n_rows, p=[0.5, 0.3, 0.2])
+    tip = np.round(np.where(rng.rand(n_rows) < 0.4,
+                            fare * rng.uniform(0.1, 0.25, n_rows), 0.0), 2)
+    tolls = np.where(rng.rand(n_rows) < 0.02, 5.54, 0.0)
+    total = np.round(fare + extra + 0.5 + 0.3 + tip + tolls, 2)
+    # refunds and disputes
+    total[rng.rand(n_rows) < 0.005] *= -1
+
+    return pd.DataFrame({
+        'vendorID': rng.randint(1, 3, n_rows),
+        'lpepPickupDatetime': pickup,
+        'lpepDropoffDatetime': dropoff,
+        'passengerCount': rng.choice(
+            7, n_rows, p=[0.01, 0.8, 0.08, 0.03, 0.02, 0.04, 0.02]),
+        'tripDistance': distance,
+        'puLocationId': np.nan,
+        'doLocationId': np.nan,
+        'pickupLongitude': pickup_longitude,
+        'pickupLatitude': pickup_latitude,
+        'dropoffLongitude': dropoff_longitude,
+        'dropoffLatitude': dropoff_latitude,
+        'rateCodeID': rng.choice([1, 2, 5], n_rows, p=[0.97, 0.01, 0.02]),
+        'storeAndFwdFlag': rng.choice(['N', 'Y'], n_rows, p=[0.99, 0.01]),
+        'paymentType': rng.choice([1, 2], n_rows, p=[0.45, 0.55]),
+        'fareAmount': fare,
+        'extra': extra,
+        'mtaTax': 0.5,
+        'improvementSurcharge': 0.3,
+        'tipAmount': tip,
+        'tollsAmount': tolls,
+        'ehailFee': np.nan,
+        'totalAmount': total,
+        'tripType': 1.0}, columns=raw_columns)
+
+
+def _write_raw_file(file_path, n_rows, seed, first_row):
+    df = synthetic_raw_trips(n_rows, seed)
+    # the open dataset export keeps the row number as unnamed index
+    df.index += first_row
+    df.to_csv(file_path)
+
+
+def generate_raw_files(raw_folder, n_rows, rows_per_file=1000000, seed=0,
+                       max_workers=None):
+    """
+    Write n_rows raw trips to csv files of rows_per_file rows, in parallel
+    processes. Files of an earlier call with the same parameters are
+    reused.
+    Returns the paths of the files.
+    """
+    os.makedirs(raw_folder, exist_ok=True)
+    config = {'rows': n_rows, 'rows_per_file': rows_per_file, 'seed': seed}
+    config_path = os.path.join(raw_folder, generator_file_name)
+    n_files = -(-n_rows // rows_per_file)
+    file_paths = [os.path.join(raw_folder, 'green_{:05d}.csv'.format(i))
+                  for i in range(n_files)]
+    if os.path.isfile(config_path):
+        with open(config_path) as f:
+            if json.load(f) == config and all(
+                    os.path.isfile(p) for p in file_paths):
+                return file_paths
+
+    with ProcessPoolExecutor(max_workers=max_workers) as executor:
+        list(executor.map(
+            _write_raw_file, file_paths,
+            [min(rows_per_file, n_rows - i * rows_per_file)
+             for i in range(n_files)],
+            [seed + i for i in range(n_files)],
+            [i * rows_per_file for i in range(n_files)]))
+    with open(config_path, 'w') as f:
+        json.dump(config, f)
+    return file_paths
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument(
+        '--raw_folder',
+        type=str,
+        dest='raw_folder',
+        help='folder to write the raw csv files to')
+    parser.add_argument(
+        '--rows',
+        type=int,
+        default=100000,
+        dest='rows',
+        help='number of raw trips')
+    parser.add_argument(
+        '--rows_per_file',
+        type=int,
+        default=1000000,
+        dest='rows_per_file',
+        help='number of trips per csv file')
+    parser.add_argument(
+        '--seed',
+        type=int,
+        default=0,
+        dest='seed',
+        help='seed of the first file, the others use the following seeds')
+    parser.add_argument(
+        '--max_workers',
+        type=int,
+        default=None,
+        dest='max_workers',
+        help='number of processes writing files, defaults to cpu count')
+    args = parser.parse_args()
+
+    file_paths = generate_raw_files(args.raw_folder, args.rows,
+                                    args.rows_per_file, args.seed,
+                                    args.max_workers)
+    print('{} raw files in {}'.format(len(file_paths), args.raw_folder))
+
+
+if __name__ == '__main__':
+    main()
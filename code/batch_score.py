@@ -0,0 +1,164 @@
+import os
+import glob
+import time
+import argparse
+import shutil
+import numpy as np
+import lightgbm as lgb
+from azureml.core import Run
+import utils
+import consts
+import model_io
+
+prediction_column = 'predicted_duration'
+row_id_column = 'row_id'
+# parquet predictions are written to this folder of the output folder
+predictions_dataset = 'predictions'
+_worker_state = {}
+
+
+def _init_score_worker(model_path, num_threads):
+    """
+    Load the model once per worker process.
+    """
+    model = model_io.load_model(model_path)
+    _worker_state['model'] = model
+    _worker_state['spatial'] = model.num_feature() == (
+        len(utils.feature_columns) + len(utils.spatial_feature_columns))
+    _worker_state['predict_params'] = (
+        {'num_threads': num_threads} if isinstance(model, lgb.Booster)
+        else {})
+
+
+def score_chunk(df, model, spatial=False, predict_params=None):
+    """
+    Return the chunk of processed data with the model's predictions.
+    """
+    feature_names = list(utils.feature_columns)
+    if spatial:
+        df = utils.add_spatial_features(df)
+        feature_names += utils.spatial_feature_columns
+    x = utils.feature_matrix(df, feature_names)
+    return df.assign(**{
+        prediction_column: model.predict(
+            x, **(predict_params or {})).astype(np.float32)})
+
+
+def _score_and_write(task):
+    part, first_row_id, df, output_folder, file_format = task
+    df = score_chunk(df, _worker_state['model'], _worker_state['spatial'],
+                     _worker_state['predict_params'])
+    df.insert(0, row_id_column,
+              np.arange(first_row_id, first_row_id + len(df)))
+    if file_format == 'parquet':
+        utils.write_train_data(df, output_folder,
+                               predictions_dataset + '.parquet',
+                               file_format='parquet')
+    else:
+        utils.write_train_data(
+            df, output_folder, 'part-{:05d}.csv'.format(part))
+    return len(df)
+
+
+def _remove_predictions(output_folder):
+    """
+    Remove the predictions of an earlier run, parquet appends to the
+    dataset and a run with fewer chunks would leave csv parts behind.
+    """
+    dataset_folder = os.path.join(output_folder, predictions_dataset)
+    if os.path.isdir(dataset_folder):
+        shutil.rmtree(dataset_folder)
+    for part in glob.glob(os.path.join(output_folder, 'part-*.csv')):
+        os.remove(part)
+
+
+def batch_score(model_path, data_folder, output_folder, chunksize=100000,
+                file_format='csv', max_workers=None):
+    """
+    Stream the processed data in chunks to a pool of worker processes that
+    each load the model once, predict the chunks and write them with
+    their predictions and a row_id key, as numbered csv parts or as
+    parquet partitioned by month_num, replacing the predictions of an
+    earlier run. At most two chunks per worker are in flight, so memory
+    doesn't grow with the data.
+    Returns the number of rows scored.
+    """
+    cpu_count = os.cpu_count() or 1
+    n_workers = max(1, min(max_workers or cpu_count, cpu_count))
+    _remove_predictions(output_folder)
+    chunks = utils.iter_train_data(data_folder, chunksize)
+    n_rows = 0
+    with model_io.worker_pool(
+            n_workers, _init_score_worker,
+            (model_path, max(1, cpu_count // n_workers))) as pool:
+        pending = []
+        first_row_id = 0
+        for part, df in enumerate(chunks):
+            pending.append(pool.apply_async(_score_and_write, (
+                (part, first_row_id, df, output_folder, file_format),)))
+            first_row_id += len(df)
+            if len(pending) >= 2 * n_workers:
+                n_rows += pending.pop(0).get()
+        for result in pending:
+            n_rows += result.get()
+    return n_rows
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument(
+        '--model_path',
+        type=str,
+        default=consts.model_output_folder,
+        dest='model_path',
+        help='model folder or pickled model file written by train.py')
+    parser.add_argument(
+        '--data_folder',
+        type=str,
+        required=True,
+        dest='data_folder',
+        help='folder with the processed data to score')
+    parser.add_argument(
+        '--output_folder',
+        type=str,
+        default=os.path.join('outputs', 'predictions'),
+        dest='output_folder',
+        help='folder to write the predictions to')
+    parser.add_argument(
+        '--chunk_size',
+        type=int,
+        default=100000,
+        dest='chunk_size',
+        help='rows scored per task')
+    parser.add_argument(
+        '--output_format',
+        type=str,
+        default='csv',
+        choices=['csv', 'parquet'],
+        dest='output_format',
+        help='write csv parts or parquet partitioned by month_num')
+    parser.add_argument(
+        '--max_workers',
+        type=int,
+        default=None,
+        dest='max_workers',
+        help='number of worker processes, defaults to the cpu count')
+    args = parser.parse_args()
+
+    run = Run.get_context()
+    run.tag('data_folder',
+            utils.last_two_folders_if_exists(args.data_folder))
+    start = time.perf_counter()
+    n_rows = batch_score(args.model_path, args.data_folder,
+                         args.output_folder, args.chunk_size,
+                         args.output_format, args.max_workers)
+    seconds = time.perf_counter() - start
+    run.log('scored_rows', n_rows)
+    run.log('score_seconds', seconds)
+    run.log('rows_per_second', n_rows / seconds)
+    print('scored {} rows in {:.1f}s, {:.0f} rows/s'.format(
+        n_rows, seconds, n_rows / seconds))
+
+
+if __name__ == '__main__':
+    main()
@@ -6,3 +6,6 @@ service_name = 'greentaxisvc'
 service_name_automl = 'greentaxisvcautoml'
 experiment_name = 'greentaxi_experiment'
 data_experiment_name = 'greentaxi_data_process'
+model_output_folder = 'outputs/model'
+model_native_file_name = 'greentaxi_lgbm.txt'
+model_compiled_file_name = 'greentaxi_lgbm.so'
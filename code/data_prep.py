@@ -1,7 +1,10 @@
+import os
 import time
 import argparse
 from azureml.core import Run
 import utils
+import drift
+import instrumentation
 
 
 def generate_filename():
@@ -23,22 +26,114 @@ def main():
         default='train',
         dest='processed_folder',
         help='folder in datastore where to output processed data')
+    parser.add_argument(
+        '--max_workers',
+        type=int,
+        default=None,
+        dest='max_workers',
+        help='number of processes reading raw files, defaults to cpu count')
+    parser.add_argument(
+        '--chunk_size',
+        type=int,
+        default=0,
+        dest='chunk_size',
+        help='stream raw data in chunks of this many rows, '
+             '0 processes all raw data in memory')
+    parser.add_argument(
+        '--output_format',
+        type=str,
+        default='csv',
+        choices=['csv', 'parquet', 'both'],
+        dest='output_format',
+        help='csv, parquet partitioned by month, or both, where the csv '
+             'copy is used for data drift detection')
+    parser.add_argument(
+        '--incremental',
+        action='store_true',
+        dest='incremental',
+        help='only process raw files that are new or changed since the '
+             'last run, tracked in a manifest in the processed folder')
+    parser.add_argument(
+        '--hash_raw_files',
+        action='store_true',
+        dest='hash_raw_files',
+        help='detect changed raw files by content hash in addition to '
+             'size and modification time')
+    parser.add_argument(
+        '--spatial_features',
+        action='store_true',
+        dest='spatial_features',
+        help='add grid cell and distance features of the coordinates')
+    parser.add_argument(
+        '--drift_baseline',
+        action='store_true',
+        dest='drift_baseline',
+        help='sketch the processed data as the baseline of local data '
+             'drift detection with drift.py')
     args = parser.parse_args()
 
     run = Run.get_context()
+    stages = instrumentation.Stages(
+        run, os.path.join('outputs', 'data_prep_stages.json'))
     filename = generate_filename()
 
     run.tag('raw_folder',
             utils.last_two_folders_if_exists(args.raw_folder))
     run.tag('processed_folder',
             utils.last_two_folders_if_exists(args.processed_folder))
-    run.tag('output_file', filename)
+    run.tag('output_format', args.output_format)
+    run.tag('spatial_features', args.spatial_features)
+
+    if args.incremental:
+        run.tag('output_file', utils.manifest_file_name)
+        with stages.stage('process_raw_data_incrementally') as stage:
+            n_processed, n_reused, n_removed, shape = \
+                utils.process_raw_data_incrementally(
+                    args.raw_folder, args.processed_folder,
+                    chunksize=args.chunk_size,
+                    file_format=args.output_format,
+                    use_hash=args.hash_raw_files,
+                    max_workers=args.max_workers,
+                    spatial=args.spatial_features)
+            stage.rows = shape[0]
+        run.log('raw_files_processed', n_processed)
+        run.log('raw_files_reused', n_reused)
+        run.log('raw_files_removed', n_removed)
+    elif args.chunk_size > 0:
+        run.tag('output_file', filename)
+        run.tag('chunk_size', args.chunk_size)
+        with stages.stage('process_raw_data_in_chunks') as stage:
+            shape = utils.process_raw_data_in_chunks(
+                args.raw_folder, args.processed_folder, filename,
+                args.chunk_size, file_format=args.output_format,
+                spatial=args.spatial_features)
+            stage.rows = shape[0]
+    else:
+        run.tag('output_file', filename)
+        with stages.stage('read_raw_data') as stage:
+            df = utils.read_raw_data(args.raw_folder,
+                                     usecols=utils.raw_columns_used,
+                                     max_workers=args.max_workers)
+            stage.rows = len(df)
+        with stages.stage('process_raw_data', rows=len(df)):
+            df = utils.process_raw_data(df, spatial=args.spatial_features)
+        memory_mb, memory_mb_64bit = utils.memory_usage_mb(df)
+        run.log('processed_memory_mb_64bit', memory_mb_64bit)
+        run.log('processed_memory_mb', memory_mb)
+        with stages.stage('write_train_data', rows=len(df)):
+            utils.write_train_data(df, args.processed_folder, filename,
+                                   file_format=args.output_format)
+        shape = df.shape
 
-    df = utils.read_raw_data(args.raw_folder)
-    df = utils.process_raw_data(df)
-    utils.write_train_data(df, args.processed_folder, filename)
+    run.log_list("shape", [shape[0], shape[1]])
 
-    run.log_list("shape", [df.shape[0], df.shape[1]])
+    if args.drift_baseline:
+        with stages.stage('drift_baseline') as stage:
+            baseline = drift.sketch_train_data(args.processed_folder)
+            stage.rows = baseline.n_rows
+        baseline.save(os.path.join(args.processed_folder,
+                                   drift.drift_baseline_file_name))
+        run.log('drift_baseline_rows', baseline.n_rows)
 
 
 if __name__ == '__main__':
@@ -0,0 +1,285 @@
+"""
+Local data drift detection between the training data and the inputs
+collected by the scoring service. Every feature is summarized by a
+histogram over fixed bin edges, so sketches of any part of the data
+merge by adding counts: the baseline is sketched once from the training
+data by data_prep.py, the inference sketch is updated with each new
+batch of collected inputs, and comparing them costs O(number of bins).
+Run from the repo root:
+    python code/drift.py --baseline train/drift_baseline.json \
+        --collected_folder collected --sketch drift_inference.json
+"""
+import io
+import os
+import sys
+import json
+import glob
+import argparse
+import numpy as np
+import pandas as pd
+import utils
+
+drift_baseline_file_name = 'drift_baseline.json'
+# the threshold of the DataDriftDetector created in the lgbm notebook
+default_drift_threshold = 0.1
+continuous_bins = 32
+
+
+def _integer_edges(low, high):
+    return np.arange(low - 0.5, high + 1.0)
+
+
+# fixed edges, histograms of any data are comparable and mergeable;
+# values outside of them fall into an underflow and an overflow bin
+drift_bin_edges = {
+    'vendorID': _integer_edges(1, 2),
+    'passengerCount': _integer_edges(1, 9),
+    'tripDistance': np.geomspace(
+        utils.min_distance, utils.max_distance, continuous_bins + 1),
+    'pickupLongitude': np.linspace(
+        utils.min_longitude, utils.max_longitude, continuous_bins + 1),
+    'pickupLatitude': np.linspace(
+        utils.min_latitude, utils.max_latitude, continuous_bins + 1),
+    'dropoffLongitude': np.linspace(
+        utils.min_longitude, utils.max_longitude, continuous_bins + 1),
+    'dropoffLatitude': np.linspace(
+        utils.min_latitude, utils.max_latitude, continuous_bins + 1),
+    'totalAmount': np.geomspace(1, 1000, continuous_bins + 1),
+    'month_num': _integer_edges(1, 12),
+    'day_of_month': _integer_edges(1, 31),
+    'day_of_week': _integer_edges(0, 6),
+    'hour_of_day': _integer_edges(0, 23)}
+
+
+class FeatureSketches:
+    """
+    Histograms of the model features, plus how far every collected input
+    file has been read so updates only read what's new.
+    """
+
+    def __init__(self, counts=None, sources=None):
+        # bins: underflow, one per pair of edges, overflow and missing
+        self.counts = counts or {
+            col: np.zeros(len(drift_bin_edges[col]) + 2, dtype=np.int64)
+            for col in utils.feature_columns}
+        self.sources = sources or {}
+
+    @property
+    def n_rows(self):
+        return int(self.counts[utils.feature_columns[0]].sum())
+
+    def update(self, data):
+        """
+        Add rows of features, a dataframe with the feature columns or an
+        array with the features in model order.
+        """
+        for i, col in enumerate(utils.feature_columns):
+            if isinstance(data, pd.DataFrame):
+                values = data[col].values
+            else:
+                values = np.asarray(data)[:, i]
+            values = values.astype(np.float64)
+            missing = np.isnan(values)
+            bins = np.searchsorted(drift_bin_edges[col], values[~missing],
+                                   side='right')
+            counts = self.counts[col]
+            counts[:-1] += np.bincount(bins, minlength=len(counts) - 1)
+            counts[-1] += missing.sum()
+        return self
+
+    def merge(self, other):
+        for col in utils.feature_columns:
+            self.counts[col] += other.counts[col]
+        self.sources.update(other.sources)
+        return self
+
+    def save(self, file_path):
+        sketch = {
+            'counts': {col: counts.tolist()
+                       for col, counts in self.counts.items()},
+            'sources': self.sources}
+        # write to a temporary file first, so a failed run can't leave a
+        # truncated sketch behind
+        with open(file_path + '.tmp', 'w') as f:
+            json.dump(sketch, f)
+        os.replace(file_path + '.tmp', file_path)
+
+    @classmethod
+    def load(cls, file_path):
+        with open(file_path) as f:
+            sketch = json.load(f)
+        return cls({col: np.array(counts, dtype=np.int64)
+                    for col, counts in sketch['counts'].items()},
+                   sketch['sources'])
+
+
+def sketch_train_data(data_folder, chunksize=500000):
+    """
+    Sketch the processed training data, streamed chunk by chunk.
+    """
+    sketch = FeatureSketches()
+    for chunk in utils.iter_train_data(
+            data_folder, chunksize, columns=utils.feature_columns):
+        sketch.update(chunk)
+    return sketch
+
+
+def _read_jsonl_inputs(file_path, offset):
+    # local_server.py collects one json list of rows per request
+    rows = []
+    with open(file_path, 'rb') as f:
+        f.seek(offset)
+        for line in iter(f.readline, b''):
+            if not line.endswith(b'\n'):
+                # still being written, read it next time
+                break
+            offset += len(line)
+            record = json.loads(line.decode('utf-8'))
+            if isinstance(record, list):
+                rows.extend(record)
+    data = np.array(rows, dtype=np.float64).reshape(
+        -1, len(utils.feature_columns))
+    return data, offset
+
+
+def _read_csv_inputs(file_path, offset):
+    # ModelDataCollector writes csv files with a column per feature
+    with open(file_path, 'rb') as f:
+        header = f.readline()
+        if not header.endswith(b'\n'):
+            return np.empty((0, len(utils.feature_columns))), offset
+        offset = max(offset, len(header))
+        f.seek(offset)
+        data = f.read()
+    # a last line that's still being written is read next time
+    end = data.rfind(b'\n') + 1
+    df = pd.read_csv(io.BytesIO(header + data[:end]),
+                     usecols=utils.feature_columns)
+    return df, offset + end
+
+
+def _is_collected_inputs(key):
+    # ModelDataCollector: <model>/<version>/inputs/<yyyy>/<mm>/<dd>/*.csv,
+    # local_server.py: <model>_inputs_<pid>.jsonl
+    parts = key.split('/')
+    if key.endswith('.csv'):
+        return 'inputs' in parts[:-1]
+    return key.endswith('.jsonl') and 'inputs' in parts[-1]
+
+
+def update_from_collected(sketch, collected_folder):
+    """
+    Add the inputs collected since the last update, csv files of the
+    model data collector and json lines files of local_server.py, to the
+    sketch. Every file is read from the byte offset the last update
+    stopped at. Returns the number of rows added.
+    """
+    n_rows = sketch.n_rows
+    pattern = os.path.join(collected_folder, '**', '*')
+    for file_path in sorted(glob.glob(pattern, recursive=True)):
+        key = os.path.relpath(file_path, collected_folder).replace(
+            os.sep, '/')
+        if not os.path.isfile(file_path) or not _is_collected_inputs(key):
+            continue
+        offset = sketch.sources.get(key, 0)
+        if key.endswith('.jsonl'):
+            data, offset = _read_jsonl_inputs(file_path, offset)
+        else:
+            data, offset = _read_csv_inputs(file_path, offset)
+        sketch.update(data)
+        sketch.sources[key] = offset
+    return sketch.n_rows - n_rows
+
+
+def feature_distances(baseline, current):
+    """
+    Total variation distance between the baseline and the current
+    histogram of every feature, from 0 for the same distribution to 1
+    for distributions without overlap. Small samples have a distance
+    above 0 from sampling noise alone, about 0.03 at 10000 rows.
+    """
+    distances = {}
+    for col in utils.feature_columns:
+        expected = baseline.counts[col] / max(baseline.counts[col].sum(), 1)
+        actual = current.counts[col] / max(current.counts[col].sum(), 1)
+        distances[col] = float(np.abs(expected - actual).sum() / 2)
+    return distances
+
+
+def detect_drift(baseline, current, drift_threshold=default_drift_threshold):
+    """
+    Compare the sketches. The drift coefficient is the largest feature
+    distance and there's drift when it exceeds drift_threshold.
+    """
+    distances = feature_distances(baseline, current)
+    drift_coefficient = max(distances.values())
+    return {
+        'drift': current.n_rows > 0 and drift_coefficient > drift_threshold,
+        'drift_coefficient': drift_coefficient,
+        'drift_threshold': drift_threshold,
+        'drifted_features': sorted(
+            col for col, distance in distances.items()
+            if distance > drift_threshold),
+        'feature_distances': distances,
+        'baseline_rows': baseline.n_rows,
+        'current_rows': current.n_rows}
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument(
+        '--baseline',
+        type=str,
+        required=True,
+        dest='baseline',
+        help='baseline sketch of the training data written by data prep')
+    parser.add_argument(
+        '--train_data_folder',
+        type=str,
+        default=None,
+        dest='train_data_folder',
+        help='sketch this processed data as the baseline, if the baseline '
+             'file does not exist yet')
+    parser.add_argument(
+        '--collected_folder',
+        type=str,
+        required=True,
+        dest='collected_folder',
+        help='folder with the inputs collected by the scoring service')
+    parser.add_argument(
+        '--sketch',
+        type=str,
+        default='drift_inference.json',
+        dest='sketch',
+        help='sketch of the collected inputs, updated with new inputs')
+    parser.add_argument(
+        '--drift_threshold',
+        type=float,
+        default=default_drift_threshold,
+        dest='drift_threshold',
+        help='drift coefficient above which the inputs have drifted')
+    args = parser.parse_args()
+    if not os.path.isfile(args.baseline) and not args.train_data_folder:
+        parser.error('baseline {} does not exist, pass --train_data_folder '
+                     'to sketch it from the training data'.format(
+                         args.baseline))
+
+    if os.path.isfile(args.baseline):
+        baseline = FeatureSketches.load(args.baseline)
+    else:
+        baseline = sketch_train_data(args.train_data_folder)
+        baseline.save(args.baseline)
+    current = FeatureSketches()
+    if os.path.isfile(args.sketch):
+        current = FeatureSketches.load(args.sketch)
+    n_rows = update_from_collected(current, args.collected_folder)
+    current.save(args.sketch)
+    print('added {} collected rows'.format(n_rows))
+
+    result = detect_drift(baseline, current, args.drift_threshold)
+    print(json.dumps(result, indent=2))
+    return 1 if result['drift'] else 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
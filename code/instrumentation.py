@@ -0,0 +1,126 @@
+import os
+import json
+import time
+import resource
+import functools
+from contextlib import contextmanager
+
+
+class Stage:
+    """
+    Measurements of one stage. Set rows to the number of rows the stage
+    handled to also get rows per second.
+    """
+
+    def __init__(self, name):
+        self.name = name
+        self.rows = None
+        self.wall_seconds = None
+        self.cpu_seconds = None
+        self.peak_rss_mb = None
+
+    def to_dict(self):
+        stage = {
+            'stage': self.name,
+            'wall_seconds': self.wall_seconds,
+            'cpu_seconds': self.cpu_seconds,
+            'peak_rss_mb': self.peak_rss_mb}
+        if self.rows is not None:
+            stage['rows'] = self.rows
+            stage['rows_per_second'] = self.rows / max(self.wall_seconds,
+                                                       1e-9)
+        return stage
+
+
+def _cpu_seconds():
+    # worker processes count once they have been joined
+    times = os.times()
+    return (times.user + times.system +
+            times.children_user + times.children_system)
+
+
+def _reset_peak_rss():
+    """
+    Reset the peak resident set size of the process so the next reading
+    is the peak of the stage. Returns False where that isn't supported,
+    then the peak is the process' peak so far.
+    """
+    try:
+        with open('/proc/self/clear_refs', 'w') as f:
+            f.write('5')
+        return True
+    except OSError:
+        return False
+
+
+def _peak_rss_mb():
+    try:
+        with open('/proc/self/status') as f:
+            for line in f:
+                if line.startswith('VmHWM:'):
+                    return int(line.split()[1]) / 1024
+    except OSError:
+        pass
+    # kilobytes on linux
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024
+
+
+class Stages:
+    """
+    Record wall time, cpu time including worker processes, peak RSS and
+    rows per second of the stages of a script. Every stage is logged as a
+    row of the 'stage' table of the run; without an azureml run context,
+    the stages are written to a json report instead.
+    """
+
+    def __init__(self, run, report_path=None):
+        self._run = run
+        self._offline = run is None or \
+            str(getattr(run, 'id', '')).startswith('OfflineRun')
+        self._report_path = report_path or os.path.join(
+            'outputs', 'stages.json')
+        self.stages = []
+
+    @contextmanager
+    def stage(self, name, rows=None):
+        """
+        Measure the body of the with statement as the stage name.
+        """
+        stage = Stage(name)
+        stage.rows = rows
+        _reset_peak_rss()
+        wall_start = time.perf_counter()
+        cpu_start = _cpu_seconds()
+        yield stage
+        stage.wall_seconds = time.perf_counter() - wall_start
+        stage.cpu_seconds = _cpu_seconds() - cpu_start
+        stage.peak_rss_mb = _peak_rss_mb()
+        self._record(stage)
+
+    def timed(self, name, count_rows=None):
+        """
+        Decorator measuring every call of the function as the stage name.
+        count_rows gets the result and returns the number of rows.
+        """
+        def decorator(func):
+            @functools.wraps(func)
+            def wrapper(*args, **kwargs):
+                with self.stage(name) as stage:
+                    result = func(*args, **kwargs)
+                    if count_rows is not None:
+                        stage.rows = count_rows(result)
+                return result
+            return wrapper
+        return decorator
+
+    def _record(self, stage):
+        self.stages.append(stage.to_dict())
+        print('stage {}: {}'.format(stage.name, json.dumps(stage.to_dict())))
+        if not self._offline:
+            self._run.log_row('stage', **stage.to_dict())
+            return
+        report_folder = os.path.dirname(self._report_path)
+        if report_folder:
+            os.makedirs(report_folder, exist_ok=True)
+        with open(self._report_path, 'w') as f:
+            json.dump(self.stages, f, indent=2)
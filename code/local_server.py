@@ -0,0 +1,287 @@
+"""
+Serve score.py or score_automl.py over HTTP on a plain Linux box, with
+local stand-ins for the azureml model registry and data collection, to
+measure latency and throughput of the scoring path without deploying.
+Run from the repo root after training a model locally:
+    python code/local_server.py --entry_script code/score.py \
+        --model_path outputs/model --workers 4
+and score with
+    curl -X POST -H 'Content-Type: application/json' \
+        -d @request.json http://localhost:8890/score
+"""
+import os
+import sys
+import json
+import types
+import signal
+import socket
+import argparse
+import importlib.util
+import socketserver
+import http.server
+
+
+class LocalModel:
+    """
+    Stand-in for azureml.core.model.Model that resolves registered model
+    names to local paths.
+    """
+    model_paths = {}
+    default_path = None
+
+    @classmethod
+    def get_model_path(cls, model_name, version=None, _workspace=None):
+        path = cls.model_paths.get(model_name, cls.default_path)
+        if path is None:
+            raise ValueError(
+                'no local path for model {}, pass --model_path or '
+                '--model {}=<path>'.format(model_name, model_name))
+        return path
+
+
+class LocalDataCollector:
+    """
+    Stand-in for azureml.monitoring.ModelDataCollector that appends the
+    collected records as json lines to a local folder, or drops them if
+    no folder is set.
+    """
+    folder = None
+
+    def __init__(self, model_name, designation=None, feature_names=None):
+        self._file_path = None
+        if self.folder is not None:
+            os.makedirs(self.folder, exist_ok=True)
+            self._file_path = os.path.join(
+                self.folder, '{}_{}_{}.jsonl'.format(
+                    model_name, designation, os.getpid()))
+        self._feature_names = feature_names
+
+    def collect(self, data):
+        if self._file_path is None:
+            return
+        if hasattr(data, 'tolist'):
+            data = data.tolist()
+        with open(self._file_path, 'a') as f:
+            f.write(json.dumps(data) + '\n')
+
+
+class LocalRun:
+    """
+    Stand-in for azureml.core.Run whose context is an offline run that
+    prints what is logged.
+    """
+    id = 'OfflineRun_local'
+
+    @classmethod
+    def get_context(cls):
+        return cls()
+
+    def tag(self, key, value=None):
+        print('tag {}: {}'.format(key, value))
+
+    def log(self, name, value, description=''):
+        print('log {}: {}'.format(name, value))
+
+    def log_list(self, name, value, description=''):
+        print('log {}: {}'.format(name, value))
+
+    def log_row(self, name, description=None, **kwargs):
+        print('log {}: {}'.format(name, kwargs))
+
+
+def install_azureml_stand_ins(model_paths, default_model_path,
+                              collect_folder):
+    """
+    Register the stand-ins as the azureml modules the entry scripts
+    import, so they load without the azureml sdk or a workspace.
+    """
+    LocalModel.model_paths = dict(model_paths)
+    LocalModel.default_path = default_model_path
+    LocalDataCollector.folder = collect_folder
+    modules = {
+        'azureml': types.ModuleType('azureml'),
+        'azureml.core': types.ModuleType('azureml.core'),
+        'azureml.core.model': types.ModuleType('azureml.core.model'),
+        'azureml.monitoring': types.ModuleType('azureml.monitoring')}
+    modules['azureml.core'].Run = LocalRun
+    modules['azureml.core.model'].Model = LocalModel
+    modules['azureml.monitoring'].ModelDataCollector = LocalDataCollector
+    sys.modules.update(modules)
+
+
+def load_entry_script(path):
+    """
+    Import the entry script from its folder and call its init.
+    """
+    path = os.path.abspath(path)
+    sys.path.insert(0, os.path.dirname(path))
+    spec = importlib.util.spec_from_file_location('entry_script', path)
+    entry_script = importlib.util.module_from_spec(spec)
+    spec.loader.exec_module(entry_script)
+    entry_script.init()
+    return entry_script
+
+
+def _is_schema_decorated(run):
+    try:
+        from inference_schema.schema_util import is_schema_decorated
+    except ImportError:
+        return False
+    return is_schema_decorated(run)
+
+
+def invoke(run, body, schema_decorated=None):
+    """
+    Call run with a request body like the azureml inference server: a
+    schema decorated run gets the keys of the json body as arguments and
+    any other run gets the raw body.
+    """
+    if schema_decorated is None:
+        schema_decorated = _is_schema_decorated(run)
+    if schema_decorated:
+        return run(**json.loads(body))
+    return run(body)
+
+
+def make_handler(run):
+    schema_decorated = _is_schema_decorated(run)
+
+    class ScoringHandler(http.server.BaseHTTPRequestHandler):
+        protocol_version = 'HTTP/1.1'
+        # headers and body are written separately, without this a
+        # keep-alive client waits for the delayed ack on every request
+        disable_nagle_algorithm = True
+
+        def do_GET(self):
+            self._respond(200, 'Healthy')
+
+        def do_POST(self):
+            if self.path.rstrip('/') != '/score':
+                self._respond(404, 'not found')
+                return
+            body = self.rfile.read(int(self.headers.get('Content-Length', 0)))
+            try:
+                result = invoke(run, body.decode('utf-8'), schema_decorated)
+            except Exception as e:
+                self._respond(500, str(e))
+                return
+            self._respond(200, result)
+
+        def _respond(self, status, result):
+            body = json.dumps(result).encode('utf-8')
+            self.send_response(status)
+            self.send_header('Content-Type', 'application/json')
+            self.send_header('Content-Length', str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+
+        def log_message(self, format, *args):
+            pass
+
+    return ScoringHandler
+
+
+class ThreadedHTTPServer(socketserver.ThreadingMixIn, http.server.HTTPServer):
+    daemon_threads = True
+
+
+def serve(listener, entry_script_path):
+    entry_script = load_entry_script(entry_script_path)
+    server = ThreadedHTTPServer(listener.getsockname(),
+                                make_handler(entry_script.run),
+                                bind_and_activate=False)
+    # every worker accepts connections from the shared listening socket
+    server.socket.close()
+    server.socket = listener
+    print('worker {} serving {}'.format(os.getpid(), entry_script_path))
+    server.serve_forever()
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument(
+        '--entry_script',
+        type=str,
+        default=os.path.join('code', 'score.py'),
+        dest='entry_script',
+        help='scoring script with init and run')
+    parser.add_argument(
+        '--model_path',
+        type=str,
+        default=os.path.join('outputs', 'model'),
+        dest='model_path',
+        help='local path returned for any registered model name')
+    parser.add_argument(
+        '--model',
+        type=str,
+        action='append',
+        default=[],
+        dest='models',
+        help='local path of a registered model as name=path, repeatable')
+    parser.add_argument(
+        '--collect_folder',
+        type=str,
+        default=None,
+        dest='collect_folder',
+        help='folder for the collected model data, dropped if not set')
+    parser.add_argument(
+        '--host',
+        type=str,
+        default='127.0.0.1',
+        dest='host',
+        help='address to listen on')
+    parser.add_argument(
+        '--port',
+        type=int,
+        default=8890,
+        dest='port',
+        help='port to listen on')
+    parser.add_argument(
+        '--workers',
+        type=int,
+        default=1,
+        dest='workers',
+        help='number of worker processes, each loads its own model')
+    args = parser.parse_args()
+
+    install_azureml_stand_ins(
+        [model.split('=', 1) for model in args.models],
+        args.model_path, args.collect_folder)
+    listener = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+    listener.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+    listener.bind((args.host, args.port))
+    listener.listen(128)
+    print('listening on http://{}:{}/score'.format(args.host, args.port))
+    if args.workers <= 1:
+        serve(listener, args.entry_script)
+        return
+
+    # pre-fork the workers before any model is loaded, lightgbm's openmp
+    # threads don't survive a fork
+    workers = []
+    for _ in range(args.workers):
+        pid = os.fork()
+        if pid == 0:
+            signal.signal(signal.SIGINT, signal.SIG_DFL)
+            try:
+                serve(listener, args.entry_script)
+            finally:
+                os._exit(1)
+        workers.append(pid)
+
+    def stop(signum, frame):
+        for pid in workers:
+            try:
+                os.kill(pid, signal.SIGTERM)
+            except ProcessLookupError:
+                pass
+        sys.exit(0)
+
+    signal.signal(signal.SIGINT, stop)
+    signal.signal(signal.SIGTERM, stop)
+    for _ in workers:
+        os.wait()
+
+
+if __name__ == '__main__':
+    main()
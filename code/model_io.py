@@ -0,0 +1,115 @@
+import os
+import joblib
+import multiprocessing
+import lightgbm as lgb
+import consts
+
+
+class CompiledModel:
+    """
+    Predictor of a model compiled to a shared library by treelite, with
+    the predict and num_feature methods of a lightgbm Booster.
+    """
+
+    def __init__(self, library_path):
+        import treelite_runtime
+
+        self._runtime = treelite_runtime
+        self._predictor = treelite_runtime.Predictor(library_path)
+
+    def predict(self, data):
+        return self._predictor.predict(self._runtime.DMatrix(data))
+
+    def num_feature(self):
+        return self._predictor.num_feature
+
+
+def export_model(model, model_folder, compile_model=False):
+    """
+    Save the model to the folder as a pickled Booster, as lightgbm's text
+    model format, which loads without unpickling, and optionally as a
+    shared library compiled by treelite with the local gcc toolchain.
+    Returns the paths of the saved files.
+    """
+    os.makedirs(model_folder, exist_ok=True)
+    pickle_file = os.path.join(model_folder, consts.model_name)
+    joblib.dump(value=model, filename=pickle_file)
+    native_file = os.path.join(model_folder, consts.model_native_file_name)
+    model.save_model(native_file)
+    model_files = [pickle_file, native_file]
+
+    if compile_model:
+        try:
+            import treelite
+        except ImportError:
+            print('treelite is not installed, skip compiling the model')
+            return model_files
+        library_file = os.path.join(
+            model_folder, consts.model_compiled_file_name)
+        treelite.Model.from_lightgbm(model).export_lib(
+            toolchain='gcc', libpath=library_file,
+            params={'parallel_comp': os.cpu_count() or 1}, verbose=False)
+        model_files.append(library_file)
+    return model_files
+
+
+def load_model(model_path, use_compiled=True):
+    """
+    Load a model saved by export_model. model_path is either the model
+    folder, where the compiled library is preferred if treelite_runtime
+    is installed, then the text model and then the pickled Booster, or
+    a single pickled Booster as registered by earlier versions.
+    """
+    if not os.path.isdir(model_path):
+        return joblib.load(model_path)
+
+    library_file = os.path.join(model_path, consts.model_compiled_file_name)
+    if use_compiled and os.path.isfile(library_file):
+        try:
+            return CompiledModel(library_file)
+        except ImportError:
+            print('treelite_runtime is not installed, '
+                  'skip the compiled model')
+    native_file = os.path.join(model_path, consts.model_native_file_name)
+    if os.path.isfile(native_file):
+        return lgb.Booster(model_file=native_file)
+    return joblib.load(os.path.join(model_path, consts.model_name))
+
+
+def native_explainer(model):
+    """
+    Return a function computing the per feature SHAP contributions of a
+    lightgbm model for a batch of rows with lightgbm's own pred_contrib,
+    or None if the model isn't lightgbm. A scikit-learn pipeline, like the
+    automl model, is explained at its final estimator, so contributions
+    are of the features after the pipeline's transforms.
+    """
+    transforms = []
+    estimator = model
+    if hasattr(model, 'steps'):
+        transforms = [step for _, step in model.steps[:-1]]
+        estimator = model.steps[-1][1]
+    # automl wraps the lightgbm estimator
+    estimator = getattr(estimator, 'model', estimator)
+    booster = getattr(estimator, 'booster_', estimator)
+    if not isinstance(booster, lgb.Booster):
+        return None
+
+    def explain(data):
+        for transform in transforms:
+            data = transform.transform(data)
+        # the last column is the expected value, not a feature
+        return booster.predict(data, pred_contrib=True)[:, :-1]
+    return explain
+
+
+def worker_pool(n_workers, initializer, initargs=()):
+    """
+    Return a pool of worker processes that train or predict with
+    lightgbm. The workers are spawned, lightgbm's openmp runtime isn't
+    safe to use after fork, and initializer(*initargs) runs once per
+    worker to load what every task of the worker shares.
+    """
+    context = multiprocessing.get_context('spawn')
+    return context.Pool(n_workers, initializer=initializer,
+                        initargs=initargs)
@@ -1,38 +1,72 @@
 import numpy as np
-import joblib
 from azureml.core.model import Model
 from inference_schema.schema_decorators import input_schema, output_schema
 from inference_schema.parameter_types.numpy_parameter_type \
     import NumpyParameterType
 from azureml.monitoring import ModelDataCollector
 import consts
+import utils
+import model_io
+import serving
+
+batcher = cache = None
+inputs_dc = prediction_dc = None
+
+
+def _data_collector(designation, feature_names):
+    collector = ModelDataCollector(
+            consts.model_name,
+            designation=designation,
+            feature_names=feature_names)
+    # collect in the background unless SCORE_COLLECT_ASYNC=0
+    if not serving.env_number('SCORE_COLLECT_ASYNC', 1):
+        return collector
+    return serving.AsyncCollector(
+        collector,
+        max_queue=serving.env_number('SCORE_COLLECT_QUEUE_SIZE', 10000),
+        batch_size=serving.env_number('SCORE_COLLECT_BATCH_SIZE', 100),
+        flush_interval_ms=serving.env_number(
+            'SCORE_COLLECT_FLUSH_MS', 1000.0, float),
+        policy=serving.env_number('SCORE_COLLECT_POLICY', 'drop', str))
 
 
 def init():
-    global model
+    global model, spatial_features, batcher, cache
     global inputs_dc, prediction_dc
     model_path = Model.get_model_path(consts.model_name)
-    model = joblib.load(model_path)
-    inputs_dc = ModelDataCollector(
-            consts.model_name,
-            designation="inputs",
-            feature_names=[
-                'vendorID',
-                'passengerCount',
-                'tripDistance',
-                'pickupLongitude',
-                'pickupLatitude',
-                'dropoffLongitude',
-                'dropoffLatitude',
-                'totalAmount',
-                'month_num',
-                'day_of_month',
-                'day_of_week',
-                'hour_of_day'])
-    prediction_dc = ModelDataCollector(
-            consts.model_name,
-            designation="predictions",
-            feature_names=["duration"])
+    model = model_io.load_model(model_path)
+    # models trained with spatial features get them computed per request
+    spatial_features = model.num_feature() == (
+        len(utils.feature_columns) + len(utils.spatial_feature_columns))
+    # optionally coalesce concurrent requests into one predict call
+    if batcher is not None:
+        batcher.close()
+        batcher = None
+    max_batch_rows = serving.env_number('SCORE_MICROBATCH_MAX_ROWS', 0)
+    if max_batch_rows > 0:
+        batcher = serving.MicroBatcher(
+            predict, max_batch_rows=max_batch_rows,
+            max_wait_ms=serving.env_number(
+                'SCORE_MICROBATCH_MAX_WAIT_MS', 5.0, float),
+            log_every=serving.env_number('SCORE_METRICS_LOG_EVERY', 1000))
+    # optionally cache predictions of repeated trips, a reloaded model
+    # starts with an empty cache
+    if cache is not None:
+        cache.clear()
+        cache = None
+    max_entries = serving.env_number('SCORE_CACHE_MAX_ENTRIES', 0)
+    if max_entries > 0:
+        cache = serving.PredictionCache(
+            batcher.predict if batcher is not None else predict,
+            max_entries=max_entries,
+            ttl_seconds=serving.env_number(
+                'SCORE_CACHE_TTL_SECONDS', 300.0, float),
+            precision=serving.env_number('SCORE_CACHE_PRECISION', 4))
+    for collector in (inputs_dc, prediction_dc):
+        if isinstance(collector, serving.AsyncCollector):
+            collector.close()
+    inputs_dc = _data_collector("inputs", utils.feature_columns)
+    prediction_dc = _data_collector("predictions", [utils.label_column])
 
 
 # input is an array of datapoints, each has an array of features
@@ -43,11 +77,21 @@ input_sample = np.array([
 output_sample = np.array([7.81327569])
 
 
-@input_schema('data', NumpyParameterType(input_sample))
-@output_schema(NumpyParameterType(output_sample))
-def run(data):
+def predict(data):
+    features = data
+    if spatial_features:
+        features = utils.add_spatial_features_to_matrix(data)
+    return model.predict(features)
+
+
+def score(data):
     try:
-        result = model.predict(data)
+        if cache is not None:
+            result = cache.predict(data)
+        elif batcher is not None:
+            result = batcher.predict(data)
+        else:
+            result = predict(data)
         inputs_dc.collect(data)
         prediction_dc.collect(result)
         return result.tolist()
@@ -56,3 +100,26 @@ def run(data):
         inputs_dc.collect(data)
         prediction_dc.collect(error)
         return error
+
+
+def run_fast(raw_data):
+    """
+    Parse the request body straight into a float32 feature array instead
+    of going through the input schema decorator.
+    """
+    try:
+        data = serving.parse_features_json(raw_data)
+    except ValueError as e:
+        return str(e)
+    return score(data)
+
+
+@input_schema('data', NumpyParameterType(input_sample))
+@output_schema(NumpyParameterType(output_sample))
+def run_schema(data):
+    return score(data)
+
+
+# SCORE_FAST_JSON=1 trades the generated swagger schema for faster decoding
+# of large batch requests
+run = run_fast if serving.env_number('SCORE_FAST_JSON', 0) else run_schema
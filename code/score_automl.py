@@ -1,18 +1,22 @@
 # ---------------------------------------------------------
 # Copyright (c) Microsoft Corporation. All rights reserved.
 # ---------------------------------------------------------
+import os
 import json
 import numpy as np
 import pandas as pd
 from sklearn.externals import joblib
 from azureml.core.model import Model
 import consts
+import model_io
 
 from inference_schema.schema_decorators import input_schema, output_schema
 from inference_schema.parameter_types.numpy_parameter_type \
     import NumpyParameterType
 from inference_schema.parameter_types.pandas_parameter_type \
     import PandasParameterType
+from inference_schema.parameter_types.standard_py_parameter_type \
+    import StandardPythonParameterType
 
 
 input_sample = pd.DataFrame(data=[
@@ -22,26 +26,50 @@ input_sample = pd.DataFrame(data=[
      'totalAmount': 4.8, 'month_num': 1.0, 'day_of_month': 30.0,
      'day_of_week': 4.0, 'hour_of_day': 21.0}])
 output_sample = np.array([0])
+# rows explained per call, bounds the memory of large requests
+explain_batch_rows = int(os.environ.get('SCORE_EXPLAIN_BATCH_ROWS', 1000))
 
 
 def init():
     global model
-    global scoring_model
+    global explainer
 
     model_path = Model.get_model_path(model_name=consts.model_name_automl)
-    scoring_model_path = Model.get_model_path(model_name='scoring_explainer')
     model = joblib.load(model_path)
-    scoring_model = joblib.load(scoring_model_path)
+    # SCORE_EXPLAIN_NATIVE=1 explains with lightgbm's own SHAP values of
+    # the engineered features, much faster than the scoring explainer
+    explainer = None
+    if os.environ.get('SCORE_EXPLAIN_NATIVE') == '1':
+        explainer = model_io.native_explainer(model)
+        if explainer is None:
+            print('automl model is not lightgbm, '
+                  'use the scoring explainer')
+    if explainer is None:
+        scoring_model_path = Model.get_model_path(
+            model_name='scoring_explainer')
+        explainer = joblib.load(scoring_model_path).explain
+
+
+def explain_in_batches(data):
+    local_importance_values = []
+    for start in range(0, len(data), explain_batch_rows):
+        values = explainer(data.iloc[start:start + explain_batch_rows])
+        if isinstance(values, np.ndarray):
+            values = values.tolist()
+        local_importance_values.extend(values)
+    return local_importance_values
 
 
 @input_schema('data', PandasParameterType(input_sample))
+@input_schema('explain', StandardPythonParameterType(False))
 @output_schema(NumpyParameterType(output_sample))
-def run(data):
+def run(data, explain=False):
     try:
         result = model.predict(data)
-        local_importance_values = scoring_model.explain(data)
+        if not explain:
+            return {'result': result.tolist()}
         return {'result': result.tolist(),
-                'local_importance_values': local_importance_values}
+                'local_importance_values': explain_in_batches(data)}
     except Exception as e:
         result = str(e)
         return json.dumps({"error": result})
@@ -0,0 +1,450 @@
+import os
+import json
+import time
+import queue
+import warnings
+import threading
+import collections
+import numpy as np
+import utils
+
+_coordinate_indices = [utils.feature_columns.index(col)
+                       for col in utils.coordinate_columns]
+_coordinate_bounds = np.array([
+    [utils.min_longitude, utils.min_latitude,
+     utils.min_longitude, utils.min_latitude],
+    [utils.max_longitude, utils.max_latitude,
+     utils.max_longitude, utils.max_latitude]], dtype=np.float32)
+
+
+def env_number(name, default, cast=int):
+    """
+    Read a scoring service setting from an environment variable of the
+    deployment, or return the default if it's not set.
+    """
+    value = os.environ.get(name)
+    return default if value in (None, '') else cast(value)
+
+
+def _parse_data_array(raw_data):
+    """
+    Parse the rows of a {"data": [[...], ...]} payload straight from the
+    text into a float32 array, without building python lists. Returns None
+    if the payload doesn't have that exact layout.
+    """
+    key = raw_data.find('"data"')
+    start = raw_data.find('[', key)
+    end = raw_data.rfind(']')
+    if key < 0 or start < 0 or end < start:
+        return None
+    head = raw_data[:key].strip()
+    colon = raw_data[key + len('"data"'):start].strip()
+    tail = raw_data[end + 1:].strip()
+    if head != '{' or colon != ':' or tail != '}':
+        return None
+    body = raw_data[start + 1:end].strip()
+    if not body:
+        return np.empty((0, len(utils.feature_columns)), dtype=np.float32)
+    if not body.startswith('[') or not body.endswith(']'):
+        return None
+    n_rows = body.count('[')
+    if body.count(']') != n_rows:
+        return None
+    with warnings.catch_warnings():
+        # fromstring only warns on a token it can't parse and fills in -1,
+        # leave those payloads to the json module
+        warnings.simplefilter('error', DeprecationWarning)
+        try:
+            values = np.fromstring(
+                body.replace('[', ' ').replace(']', ' '),
+                dtype=np.float32, sep=',')
+        except (DeprecationWarning, ValueError):
+            return None
+    n_features = len(utils.feature_columns)
+    if values.size != n_rows * n_features:
+        return None
+    # a row separator must sit at the end of every row
+    if body.count(',') != n_rows * (n_features - 1) + n_rows - 1:
+        return None
+    return values.reshape(n_rows, n_features)
+
+
+def parse_features_json(raw_data):
+    """
+    Decode a scoring request into a float32 array of the model features
+    and validate its shape and coordinates. The common payload layout is
+    parsed directly, anything else goes through the json module. Raises
+    ValueError for a request the model can't score.
+    """
+    if isinstance(raw_data, bytes):
+        raw_data = raw_data.decode('utf-8')
+    data = _parse_data_array(raw_data)
+    if data is None:
+        try:
+            data = np.asarray(json.loads(raw_data)['data'], dtype=np.float32)
+        except (KeyError, TypeError) as e:
+            raise ValueError(
+                'request must be a json object with a "data" array: '
+                '{}'.format(e))
+    n_features = len(utils.feature_columns)
+    if data.ndim != 2 or data.shape[1] != n_features:
+        raise ValueError(
+            'expected rows of {} features, got an array of shape {}'.format(
+                n_features, data.shape))
+    coordinates = data[:, _coordinate_indices]
+    invalid = np.flatnonzero(
+        ((coordinates < _coordinate_bounds[0]) |
+         (coordinates > _coordinate_bounds[1]) |
+         np.isnan(coordinates)).any(axis=1))
+    if invalid.size:
+        raise ValueError(
+            'coordinates outside the supported area in rows {}'.format(
+                invalid[:10].tolist()))
+    return data
+
+
+class _PendingRequest:
+    def __init__(self, rows):
+        self.rows = rows
+        self.enqueued = time.perf_counter()
+        self.done = threading.Event()
+        self.result = None
+        self.error = None
+
+
+class MicroBatcher:
+    """
+    Coalesce the rows of concurrent requests into one vectorized predict
+    call. A background thread takes the first waiting request, then keeps
+    adding requests until the batch has max_batch_rows rows or the first
+    request has waited max_wait_ms, predicts the batch and hands every
+    request its slice of the predictions.
+    """
+
+    def __init__(self, predict, max_batch_rows=256, max_wait_ms=5.0,
+                 log_every=1000):
+        self._predict = predict
+        self._max_batch_rows = max_batch_rows
+        self._max_wait = max_wait_ms / 1000.0
+        self._log_every = log_every
+        self._queue = queue.Queue()
+        self._lock = threading.Lock()
+        self._metrics = {
+            'requests': 0,
+            'batches': 0,
+            'rows': 0,
+            'max_batch_rows': 0,
+            'queue_delay_ms_total': 0.0,
+            'queue_delay_ms_max': 0.0}
+        self._thread = threading.Thread(
+            target=self._run, name='micro-batcher', daemon=True)
+        self._thread.start()
+
+    def predict(self, rows):
+        """
+        Predict the rows together with those of concurrent requests,
+        blocking until the predictions are ready.
+        """
+        request = _PendingRequest(np.asarray(rows))
+        self._queue.put(request)
+        request.done.wait()
+        if request.error is not None:
+            raise request.error
+        return request.result
+
+    def metrics(self):
+        """
+        Return counters of requests, batches and rows, and the mean and
+        max batch size and queueing delay.
+        """
+        with self._lock:
+            metrics = dict(self._metrics)
+        batches = max(metrics['batches'], 1)
+        metrics['mean_batch_rows'] = metrics['rows'] / batches
+        metrics['mean_queue_delay_ms'] = \
+            metrics['queue_delay_ms_total'] / max(metrics['requests'], 1)
+        return metrics
+
+    def close(self):
+        self._queue.put(None)
+        self._thread.join()
+
+    def _run(self):
+        while True:
+            first = self._queue.get()
+            if first is None:
+                return
+            batch = [first]
+            n_rows = len(first.rows)
+            deadline = first.enqueued + self._max_wait
+            while n_rows < self._max_batch_rows:
+                timeout = deadline - time.perf_counter()
+                if timeout <= 0:
+                    break
+                try:
+                    request = self._queue.get(timeout=timeout)
+                except queue.Empty:
+                    break
+                if request is None:
+                    # finish this batch, then stop
+                    self._queue.put(None)
+                    break
+                batch.append(request)
+                n_rows += len(request.rows)
+            self._predict_batch(batch, n_rows)
+
+    def _predict_batch(self, batch, n_rows):
+        started = time.perf_counter()
+        try:
+            if len(batch) == 1:
+                predictions = self._predict(batch[0].rows)
+            else:
+                predictions = self._predict(
+                    np.concatenate([request.rows for request in batch]))
+            offset = 0
+            for request in batch:
+                request.result = predictions[offset:offset + len(request.rows)]
+                offset += len(request.rows)
+        except Exception as e:
+            for request in batch:
+                request.error = e
+        for request in batch:
+            request.done.set()
+
+        delays = [(started - request.enqueued) * 1000 for request in batch]
+        with self._lock:
+            self._metrics['requests'] += len(batch)
+            self._metrics['batches'] += 1
+            self._metrics['rows'] += n_rows
+            self._metrics['max_batch_rows'] = max(
+                self._metrics['max_batch_rows'], n_rows)
+            self._metrics['queue_delay_ms_total'] += sum(delays)
+            self._metrics['queue_delay_ms_max'] = max(
+                self._metrics['queue_delay_ms_max'], max(delays))
+            log = (self._log_every > 0 and
+                   self._metrics['batches'] % self._log_every == 0)
+        if log:
+            print('micro batcher metrics: {}'.format(
+                json.dumps(self.metrics())))
+
+
+class AsyncCollector:
+    """
+    Move model data collection off the request path. Records are put on a
+    bounded queue and a background thread hands them to the wrapped
+    collector in batches of up to batch_size records, or whatever is
+    waiting after flush_interval_ms. When the queue is full, policy 'drop'
+    discards the record and 'block' waits for room.
+    """
+
+    def __init__(self, collector, max_queue=10000, batch_size=100,
+                 flush_interval_ms=1000.0, policy='drop'):
+        if policy not in ('drop', 'block'):
+            raise ValueError(
+                "policy must be 'drop' or 'block', got {}".format(policy))
+        self._collector = collector
+        self._batch_size = batch_size
+        self._flush_interval = flush_interval_ms / 1000.0
+        self._block = policy == 'block'
+        self._queue = queue.Queue(maxsize=max_queue)
+        self._lock = threading.Lock()
+        self._metrics = {
+            'collected': 0,
+            'dropped': 0,
+            'flushed': 0,
+            'flushes': 0,
+            'errors': 0}
+        self._thread = threading.Thread(
+            target=self._run, name='async-collector', daemon=True)
+        self._thread.start()
+
+    def collect(self, data):
+        """
+        Queue a record for collection without waiting for it to be written.
+        Returns False if the record was dropped because the queue is full.
+        """
+        try:
+            self._queue.put(data, block=self._block)
+        except queue.Full:
+            with self._lock:
+                self._metrics['dropped'] += 1
+            return False
+        with self._lock:
+            self._metrics['collected'] += 1
+        return True
+
+    def metrics(self):
+        """
+        Return counters of collected, dropped and flushed records, flush
+        calls and collector errors, and the current queue depth.
+        """
+        with self._lock:
+            metrics = dict(self._metrics)
+        metrics['queued'] = self._queue.qsize()
+        return metrics
+
+    def flush(self):
+        """
+        Block until every queued record has been handed to the collector.
+        """
+        self._queue.join()
+
+    def close(self):
+        self._queue.put(None)
+        self._thread.join()
+
+    def _run(self):
+        while True:
+            first = self._queue.get()
+            if first is None:
+                self._queue.task_done()
+                return
+            batch = [first]
+            deadline = time.perf_counter() + self._flush_interval
+            stop = False
+            while len(batch) < self._batch_size:
+                timeout = deadline - time.perf_counter()
+                if timeout <= 0:
+                    break
+                try:
+                    record = self._queue.get(timeout=timeout)
+                except queue.Empty:
+                    break
+                if record is None:
+                    self._queue.task_done()
+                    stop = True
+                    break
+                batch.append(record)
+            self._flush(batch)
+            for _ in batch:
+                self._queue.task_done()
+            if stop:
+                return
+
+    def _flush(self, batch):
+        flushes = errors = 0
+        for records in _stack_records(batch):
+            try:
+                self._collector.collect(records)
+                flushes += 1
+            except Exception as e:
+                errors += 1
+                print('model data collection failed: {}'.format(e))
+        with self._lock:
+            self._metrics['flushed'] += len(batch)
+            self._metrics['flushes'] += flushes
+            self._metrics['errors'] += errors
+
+
+def _stack_records(batch):
+    """
+    Concatenate runs of arrays with the same row shape so they are
+    collected with one call; anything else is collected on its own.
+    """
+    run = []
+    for record in batch:
+        if isinstance(record, np.ndarray) and record.ndim > 0:
+            if run and run[0].shape[1:] != record.shape[1:]:
+                yield np.concatenate(run)
+                run = []
+            run.append(record)
+            continue
+        if run:
+            yield np.concatenate(run)
+            run = []
+        yield record
+    if run:
+        yield np.concatenate(run)
+
+
+class PredictionCache:
+    """
+    Bounded LRU cache of predictions in front of a predict function, for
+    callers that re-score the same trips. Rows are keyed on their features
+    with the coordinates rounded to precision decimals, entries expire
+    after ttl_seconds and the least recently used entry is evicted when
+    the cache holds max_entries. Only the rows that miss are predicted.
+    """
+
+    def __init__(self, predict, max_entries=100000, ttl_seconds=300.0,
+                 precision=4, log_every=10000):
+        self._predict = predict
+        self._max_entries = max_entries
+        self._ttl = ttl_seconds
+        self._precision = precision
+        self._log_every = log_every
+        self._entries = collections.OrderedDict()
+        self._lock = threading.Lock()
+        self._metrics = {
+            'lookups': 0,
+            'hits': 0,
+            'misses': 0,
+            'evictions': 0,
+            'expirations': 0}
+
+    def keys(self, rows):
+        """
+        Return the cache key of every row.
+        """
+        quantized = np.array(rows, dtype=np.float64)
+        quantized[:, _coordinate_indices] = np.round(
+            quantized[:, _coordinate_indices], self._precision)
+        quantized = quantized.astype(np.float32)
+        return [row.tobytes() for row in quantized]
+
+    def predict(self, rows):
+        rows = np.asarray(rows)
+        keys = self.keys(rows)
+        result = np.empty(len(rows), dtype=np.float64)
+        missed = []
+        now = time.monotonic()
+        with self._lock:
+            for i, key in enumerate(keys):
+                entry = self._entries.get(key)
+                if entry is not None and entry[0] < now:
+                    del self._entries[key]
+                    self._metrics['expirations'] += 1
+                    entry = None
+                if entry is None:
+                    missed.append(i)
+                else:
+                    self._entries.move_to_end(key)
+                    result[i] = entry[1]
+            self._metrics['lookups'] += len(keys)
+            self._metrics['hits'] += len(keys) - len(missed)
+            self._metrics['misses'] += len(missed)
+            lookups = self._metrics['lookups']
+
+        if missed:
+            predictions = self._predict(rows[missed])
+            result[missed] = predictions
+            expires = time.monotonic() + self._ttl
+            with self._lock:
+                for i, prediction in zip(missed, predictions):
+                    self._entries[keys[i]] = (expires, prediction)
+                    self._entries.move_to_end(keys[i])
+                while len(self._entries) > self._max_entries:
+                    self._entries.popitem(last=False)
+                    self._metrics['evictions'] += 1
+
+        if self._log_every > 0 and \
+                lookups // self._log_every > \
+                (lookups - len(keys)) // self._log_every:
+            print('prediction cache metrics: {}'.format(
+                json.dumps(self.metrics())))
+        return result
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+
+    def metrics(self):
+        """
+        Return counters of lookups, hits, misses, evictions and expired
+        entries, the hit rate and the number of cached entries.
+        """
+        with self._lock:
+            metrics = dict(self._metrics)
+            metrics['entries'] = len(self._entries)
+        metrics['hit_rate'] = metrics['hits'] / max(metrics['lookups'], 1)
+        return metrics
@@ -1,56 +1,434 @@
 import os
+import json
+import time
+import glob
+import hashlib
 import argparse
-import joblib
+import threading
+from concurrent.futures import ThreadPoolExecutor
 import lightgbm as lgb
 import math
+import numpy as np
 from sklearn.metrics import mean_squared_error
-from sklearn.model_selection import train_test_split
+from sklearn.model_selection import KFold, ShuffleSplit
 from azureml.core import Run
 import utils
 import consts
+import model_io
+import instrumentation
+
+
+# parameters that determine how lightgbm bins the training data
+dataset_params = {
+    'max_bin': 255,
+    'verbose': -1
+}
+default_params = {
+    'boosting_type': 'gbdt',
+    'objective': 'regression',
+    # metric 12: mean_squared_error, 11: mean_absolute_error
+    'metric': {'l2', 'l1'},
+    'num_leaves': 31,
+    'learning_rate': 0.05,
+    'feature_fraction': 0.9,
+    'bagging_fraction': 0.8,
+    'bagging_freq': 5,
+    'verbose': 0
+}
+# booster parameters sampled by the local hyperparameter search, dataset
+# parameters can't change since all trials share one binned dataset
+search_space = {
+    'num_leaves': [15, 31, 63, 127, 255],
+    'learning_rate': [0.02, 0.05, 0.1, 0.2],
+    'feature_fraction': [0.6, 0.7, 0.8, 0.9, 1.0],
+    'bagging_fraction': [0.6, 0.7, 0.8, 0.9, 1.0],
+    'lambda_l2': [0.0, 0.1, 1.0, 10.0],
+    'max_depth': [-1, 8, 12, 16]
+}
+
+
+def to_matrix(df):
+    """
+    Build the float32 feature matrix and the label vector of the training
+    data. The month index isn't a feature.
+    Returns features, label and feature names.
+    """
+    feature_names = [col for col in df.columns if col not in (
+        utils.label_column, utils.month_index_column)]
+    x = utils.feature_matrix(df, feature_names)
+    y = df[utils.label_column].values.astype(np.float32)
+    return x, y, feature_names
 
 
 def split_data(df):
-    y_df = df.duration
-    x_df = df.drop(columns='duration')
-    x_train, x_test, y_train, y_test = \
-        train_test_split(x_df, y_df, test_size=0.2, random_state=223)
-    return x_train, x_test, y_train, y_test
-
-
-def train_model(x_train, x_test, y_train, y_test):
-    lgb_train = lgb.Dataset(x_train, y_train)
-    lgb_eval = lgb.Dataset(x_test, y_test, reference=lgb_train)
-    params = {
-        'boosting_type': 'gbdt',
-        'objective': 'regression',
-        # metric 12: mean_squared_error, 11: mean_absolute_error
-        'metric': {'l2', 'l1'},
-        'num_leaves': 31,
-        'learning_rate': 0.05,
-        'feature_fraction': 0.9,
-        'bagging_fraction': 0.8,
-        'bagging_freq': 5,
-        'verbose': 0
-    }
-    gbm = lgb.train(params,
-                    lgb_train,
-                    num_boost_round=20,
-                    valid_sets=lgb_eval,
-                    early_stopping_rounds=5,
-                    categorical_feature=[
-                        'vendorID',
-                        'month_num',
-                        'day_of_month',
-                        'day_of_week',
-                        'hour_of_day'])
-
-    # evaluate the model
+    """
+    Build the float32 feature matrix and the label vector once, and split
+    them by row index instead of copying dataframes.
+    Returns features, label, feature names, train and test row indices.
+    """
+    x, y, feature_names = to_matrix(df)
+    splitter = ShuffleSplit(n_splits=1, test_size=0.2, random_state=223)
+    train_idx, test_idx = next(splitter.split(x))
+    return x, y, feature_names, train_idx, test_idx
+
+
+def split_validation(train_idx, valid_size=0.2):
+    """
+    Split validation rows off the train rows, for the parameter search to
+    rank trials on, so the test rows stay unseen until the final model.
+    Returns train and validation row indices.
+    """
+    splitter = ShuffleSplit(n_splits=1, test_size=valid_size,
+                            random_state=223)
+    train_pos, valid_pos = next(splitter.split(train_idx))
+    return train_idx[train_pos], train_idx[valid_pos]
+
+
+def dataset_cache_path(cache_dir, data_folder, feature_names,
+                       max_cached=3):
+    """
+    Return the path of the cached binary dataset for the training data
+    files and the binning parameters. The key is a hash of the data
+    files' paths relative to the data folder, sizes and modification
+    times, the dataset parameters and the features, so any change to the
+    processed data or the binning gets a new dataset. Only the most
+    recently used max_cached datasets are kept.
+    """
+    key = {
+        'files': [
+            [os.path.relpath(f, data_folder), utils.file_signature(f)]
+            for f in utils.list_train_files(data_folder)],
+        'dataset_params': dataset_params,
+        'feature_names': feature_names,
+        'categorical_feature': [
+            col for col in utils.categorical_columns
+            if col in feature_names]}
+    digest = hashlib.sha256(
+        json.dumps(key, sort_keys=True).encode('utf-8')).hexdigest()
+    binary_path = os.path.join(cache_dir, digest[:32] + '.bin')
+
+    if os.path.isfile(binary_path):
+        os.utime(binary_path)
+    cached = sorted(glob.glob(os.path.join(cache_dir, '*.bin')),
+                    key=os.path.getmtime, reverse=True)
+    for stale in cached[max_cached:]:
+        if stale != binary_path:
+            os.remove(stale)
+    return binary_path
+
+
+def build_dataset(x, y, feature_names, binary_path=None):
+    """
+    Create the lightgbm dataset of all rows, which train and test row
+    indices are subsets of, so the data is binned once. If binary_path
+    is given, the binned dataset is saved there, or loaded from there if
+    it exists, to reuse it across retraining runs on the same data.
+    """
+    if binary_path is not None and os.path.isfile(binary_path):
+        print('Loading lightgbm dataset from {}'.format(binary_path))
+        return lgb.Dataset(binary_path, params=dataset_params).construct()
+    dataset = lgb.Dataset(
+        x, label=y, feature_name=feature_names,
+        categorical_feature=[
+            col for col in utils.categorical_columns
+            if col in feature_names],
+        params=dataset_params, free_raw_data=True).construct()
+    if binary_path is not None:
+        os.makedirs(os.path.dirname(binary_path) or '.', exist_ok=True)
+        # concurrent runs never see a partially written dataset
+        dataset.save_binary(binary_path + '.tmp')
+        os.replace(binary_path + '.tmp', binary_path)
+    return dataset
+
+
+def train_model(dataset, x, y, train_idx, test_idx, params=default_params,
+                num_boost_round=20):
+    """
+    Train on the train rows of the dataset and evaluate on the test rows.
+    Both are row index subsets of the binned dataset, only the test rows
+    of the feature matrix are copied for prediction.
+    """
+    lgb_train = dataset.subset(train_idx)
+    lgb_eval = dataset.subset(test_idx)
+    gbm = _train_subsets(params, lgb_train, lgb_eval,
+                         dataset.categorical_feature, num_boost_round)
+    rmse, mape = evaluate_model(gbm, x[test_idx], y[test_idx])
+
+    return gbm, rmse, mape
+
+
+def _iter_streaming_chunks(data_folder, chunksize, spatial, test_size):
+    """
+    Yield the feature matrix, label and holdout mask of every chunk of
+    the training data. The holdout rows of a chunk are drawn from a seed
+    of its position, so every pass over the data holds out the same rows.
+    """
+    chunks = utils.iter_train_data(data_folder, chunksize)
+    for i, df in enumerate(chunks):
+        if spatial:
+            df = utils.add_spatial_features(df)
+        x, y, feature_names = to_matrix(utils.downcast_train_data(df))
+        holdout = np.random.RandomState(223 + i).rand(len(y)) < test_size
+        yield x, y, feature_names, holdout
+
+
+def _update_reservoir(reservoir, seen, x, y, rng):
+    """
+    Keep a uniform sample of all rows seen so far (algorithm R), updated
+    with a whole chunk at once.
+    Returns the number of rows seen including the chunk.
+    """
+    size = len(reservoir['y'])
+    n_fill = min(max(reservoir['capacity'] - size, 0), len(y))
+    if n_fill:
+        reservoir['x'] = np.concatenate([reservoir['x'], x[:n_fill]])
+        reservoir['y'] = np.concatenate([reservoir['y'], y[:n_fill]])
+    rest = np.arange(n_fill, len(y))
+    # row t of the stream replaces a random slot with probability k / t
+    slots = rng.randint(0, seen + rest + 1)
+    accepted = slots < reservoir['capacity']
+    reservoir['x'][slots[accepted]] = x[rest[accepted]]
+    reservoir['y'][slots[accepted]] = y[rest[accepted]]
+    return seen + len(y)
+
+
+def train_model_streaming(data_folder, chunksize, spatial=False,
+                          params=default_params, rounds_per_chunk=10,
+                          sample_size=200000, test_size=0.2):
+    """
+    Train without holding the training data in memory. A first pass over
+    the chunks keeps a reservoir sample of the training rows, which
+    lightgbm bins the data with, and a reservoir of holdout rows to
+    evaluate on. A second pass continues training the booster chunk by
+    chunk with init_model, every chunk binned like the sample.
+    Returns the model, rmse and mape on the holdout rows and the number
+    of training rows.
+    """
+    rng = np.random.RandomState(223)
+    sample = None
+    holdout = None
+    seen = [0, 0]
+    for x, y, feature_names, is_holdout in _iter_streaming_chunks(
+            data_folder, chunksize, spatial, test_size):
+        if sample is None:
+            sample = {'capacity': sample_size,
+                      'x': x[:0], 'y': y[:0]}
+            holdout = {'capacity': int(sample_size * test_size),
+                       'x': x[:0], 'y': y[:0]}
+        seen[0] = _update_reservoir(
+            sample, seen[0], x[~is_holdout], y[~is_holdout], rng)
+        seen[1] = _update_reservoir(
+            holdout, seen[1], x[is_holdout], y[is_holdout], rng)
+
+    categorical_feature = [
+        col for col in utils.categorical_columns if col in feature_names]
+    reference = lgb.Dataset(
+        sample['x'], label=sample['y'], feature_name=feature_names,
+        categorical_feature=categorical_feature,
+        params=dataset_params).construct()
+    del sample
+
+    gbm = None
+    for x, y, _, is_holdout in _iter_streaming_chunks(
+            data_folder, chunksize, spatial, test_size):
+        lgb_chunk = lgb.Dataset(
+            x[~is_holdout], label=y[~is_holdout], reference=reference,
+            feature_name=feature_names,
+            categorical_feature=categorical_feature, params=dataset_params)
+        gbm = lgb.train(params,
+                        lgb_chunk,
+                        num_boost_round=rounds_per_chunk,
+                        init_model=gbm,
+                        keep_training_booster=True,
+                        categorical_feature=categorical_feature)
+
+    rmse, mape = evaluate_model(gbm, holdout['x'], holdout['y'])
+    return gbm, rmse, mape, seen[0]
+
+
+def _train_subsets(params, lgb_train, lgb_eval, categorical_feature,
+                   num_boost_round):
+    return lgb.train(params,
+                     lgb_train,
+                     num_boost_round=num_boost_round,
+                     valid_sets=lgb_eval,
+                     early_stopping_rounds=5,
+                     # same as the dataset, subsets can't change it
+                     categorical_feature=categorical_feature)
+
+
+def evaluate_model(gbm, x_test, y_test):
     y_predict = gbm.predict(x_test)
     rmse = math.sqrt(mean_squared_error(y_true=y_test, y_pred=y_predict))
     mape = utils.MAPE(y_test, y_predict)
+    return rmse, mape
 
-    return gbm, rmse, mape
+
+def sample_search_params(n_trials, num_threads, seed=223):
+    """
+    Sample n_trials distinct parameter configurations from search_space,
+    each on top of default_params and limited to num_threads threads.
+    """
+    rng = np.random.RandomState(seed)
+    n_configs = int(np.prod([len(v) for v in search_space.values()]))
+    configs = []
+    seen = set()
+    while len(configs) < min(n_trials, n_configs):
+        choice = tuple(
+            rng.randint(len(values)) for values in search_space.values())
+        if choice in seen:
+            continue
+        seen.add(choice)
+        config = dict(default_params, num_threads=num_threads)
+        for (name, values), i in zip(search_space.items(), choice):
+            config[name] = values[i]
+        configs.append(config)
+    return configs
+
+
+def _run_search_trial(lgb_train, lgb_eval, categorical_feature, x_valid,
+                      y_valid, trial):
+    trial_id, params, num_boost_round = trial
+    start = time.perf_counter()
+    gbm = _train_subsets(params, lgb_train, lgb_eval, categorical_feature,
+                         num_boost_round)
+    rmse, mape = evaluate_model(gbm, x_valid, y_valid)
+    result = {
+        'trial': trial_id,
+        'num_boost_round': num_boost_round,
+        'best_iteration': gbm.best_iteration,
+        'rmse': rmse,
+        'mape': mape,
+        'seconds': time.perf_counter() - start}
+    result.update({name: params[name] for name in search_space})
+    return result
+
+
+def search_params(dataset, x, y, train_idx, valid_idx, n_trials,
+                  max_workers=None, min_rounds=20, max_rounds=180, eta=3):
+    """
+    Evaluate sampled parameter configurations in parallel threads with
+    successive halving: every configuration is trained for min_rounds,
+    then the best 1/eta of them for eta times as many rounds, until
+    max_rounds. Lightgbm releases the GIL while it trains, and all trials
+    share the train and valid subsets of the one binned dataset, so
+    memory doesn't grow with the number of workers. Lightgbm threads are
+    split evenly across workers. Trials are early stopped and ranked on
+    the valid_idx rows, which must not overlap the rows the final model
+    is evaluated on.
+    Returns the results of every trial, the best parameters and their
+    number of boosting rounds.
+    """
+    cpu_count = os.cpu_count() or 1
+    n_workers = max(1, min(max_workers or cpu_count, n_trials))
+    configs = sample_search_params(
+        n_trials, num_threads=max(1, cpu_count // n_workers))
+
+    lgb_train = dataset.subset(train_idx).construct()
+    lgb_eval = dataset.subset(valid_idx).construct()
+    x_valid, y_valid = x[valid_idx], y[valid_idx]
+
+    def run_trial(trial):
+        return _run_search_trial(lgb_train, lgb_eval,
+                                 dataset.categorical_feature, x_valid,
+                                 y_valid, trial)
+
+    results = []
+    candidates = list(range(len(configs)))
+    num_boost_round = min_rounds
+    with ThreadPoolExecutor(max_workers=n_workers) as executor:
+        while True:
+            rung = list(executor.map(run_trial, [
+                (i, configs[i], num_boost_round) for i in candidates]))
+            results += rung
+            rung.sort(key=lambda result: result['rmse'])
+            if num_boost_round >= max_rounds or len(rung) == 1:
+                break
+            candidates = [result['trial']
+                          for result in rung[:max(1, len(rung) // eta)]]
+            num_boost_round = min(max_rounds, num_boost_round * eta)
+
+    best = rung[0]
+    best_params = dict(configs[best['trial']])
+    best_params.pop('num_threads')
+    return results, best_params, best['num_boost_round']
+
+
+def kfold_folds(n_rows, n_folds):
+    """
+    Shuffled k-fold cross validation folds.
+    Returns a list of train row indices, test row indices and fold name.
+    """
+    splitter = KFold(n_splits=n_folds, shuffle=True, random_state=223)
+    return [(train_idx, test_idx, 'fold_{}'.format(i))
+            for i, (train_idx, test_idx)
+            in enumerate(splitter.split(np.empty((n_rows, 0))))]
+
+
+def rolling_month_folds(month, n_folds, window=0):
+    """
+    Time aware cross validation folds by month: each of the last n_folds
+    months is validated on with a model trained on the months before it,
+    or only the window months before it if window is set, so no fold
+    trains on data from after the month it validates on. month is the
+    month_index of data prep, year * 12 + month, so months of different
+    years are ordered.
+    Returns a list of train row indices, test row indices and fold name,
+    with fewer than n_folds folds if there aren't n_folds + 1 months.
+    """
+    months = np.unique(month)
+    folds = []
+    for m in months[1:][-n_folds:]:
+        train_mask = month < m
+        if window > 0:
+            train_mask &= month >= m - window
+        year, month_num = divmod(int(m) - 1, 12)
+        folds.append((np.flatnonzero(train_mask),
+                      np.flatnonzero(month == m),
+                      'month_{}_{:02d}'.format(year, month_num + 1)))
+    return folds
+
+
+def _run_cv_fold(dataset, x, y, fold, params, num_boost_round, lock):
+    train_idx, test_idx, name = fold
+    start = time.perf_counter()
+    # the folds share the binned dataset, subsets are copied one at a time
+    with lock:
+        lgb_train = dataset.subset(train_idx).construct()
+        lgb_eval = dataset.subset(test_idx).construct()
+    gbm = _train_subsets(params, lgb_train, lgb_eval,
+                         dataset.categorical_feature, num_boost_round)
+    del lgb_train, lgb_eval
+    rmse, mape = evaluate_model(gbm, x[test_idx], y[test_idx])
+    return {
+        'fold': name,
+        'train_rows': len(train_idx),
+        'test_rows': len(test_idx),
+        'best_iteration': gbm.best_iteration,
+        'rmse': rmse,
+        'mape': mape,
+        'seconds': time.perf_counter() - start}
+
+
+def cross_validate(dataset, x, y, folds, params=default_params,
+                   num_boost_round=20, max_workers=None):
+    """
+    Train and evaluate the folds in parallel threads, lightgbm releases
+    the GIL while it trains. All folds share the one binned dataset and
+    feature matrix, every running fold only adds its binned subset, so
+    memory grows with the number of workers by one fold of binned rows
+    each. Lightgbm threads are split evenly across workers.
+    Returns the results of every fold.
+    """
+    cpu_count = os.cpu_count() or 1
+    n_workers = max(1, min(max_workers or cpu_count, len(folds)))
+    params = dict(params, num_threads=max(1, cpu_count // n_workers))
+    lock = threading.Lock()
+    with ThreadPoolExecutor(max_workers=n_workers) as executor:
+        return list(executor.map(
+            lambda fold: _run_cv_fold(dataset, x, y, fold, params,
+                                      num_boost_round, lock),
+            folds))
 
 
 def main():
@@ -62,27 +440,206 @@ def main():
         default='',
         dest='data_folder',
         help='folder in datastore where training data is located')
+    parser.add_argument(
+        '--spatial_features',
+        action='store_true',
+        dest='spatial_features',
+        help='train with grid cell and distance features, added to the '
+             'training data if data prep did not add them')
+    parser.add_argument(
+        '--dataset_binary',
+        type=str,
+        default=None,
+        dest='dataset_binary',
+        help='lightgbm binary dataset file to load, or to save for '
+             'retraining on the same data, instead of the dataset cache')
+    parser.add_argument(
+        '--dataset_cache_dir',
+        type=str,
+        default=None,
+        dest='dataset_cache_dir',
+        help='folder to cache binned lightgbm datasets in, keyed by the '
+             'training data and binning parameters, e.g. a local disk or '
+             'a folder of the datastore, not cached if not set')
+    parser.add_argument(
+        '--search_trials',
+        type=int,
+        default=0,
+        dest='search_trials',
+        help='number of parameter configurations to search locally '
+             'before training, 0 trains with the default parameters')
+    parser.add_argument(
+        '--search_workers',
+        type=int,
+        default=None,
+        dest='search_workers',
+        help='number of threads of the parameter search, all trials '
+             'share the binned dataset, defaults to the cpu count')
+    parser.add_argument(
+        '--search_max_rounds',
+        type=int,
+        default=180,
+        dest='search_max_rounds',
+        help='boosting rounds of the last successive halving rung')
+    parser.add_argument(
+        '--stream_chunk_size',
+        type=int,
+        default=0,
+        dest='stream_chunk_size',
+        help='train out of core on chunks of this many rows, 0 reads all '
+             'training data into memory')
+    parser.add_argument(
+        '--stream_rounds_per_chunk',
+        type=int,
+        default=10,
+        dest='stream_rounds_per_chunk',
+        help='boosting rounds added for every chunk when streaming')
+    parser.add_argument(
+        '--cv_folds',
+        type=int,
+        default=0,
+        dest='cv_folds',
+        help='number of cross validation folds evaluated in parallel '
+             'before training, 0 skips cross validation')
+    parser.add_argument(
+        '--cv_mode',
+        type=str,
+        default='rolling',
+        choices=['rolling', 'kfold'],
+        dest='cv_mode',
+        help='rolling validates each of the last months on the months '
+             'before it, by the month_index column of data prep, kfold '
+             'uses shuffled folds')
+    parser.add_argument(
+        '--cv_window',
+        type=int,
+        default=0,
+        dest='cv_window',
+        help='number of months before the validation month to train on '
+             'in rolling mode, 0 uses all earlier months')
+    parser.add_argument(
+        '--compile_model',
+        action='store_true',
+        dest='compile_model',
+        help='also compile the model to a shared library with treelite')
     args = parser.parse_args()
 
     run = Run.get_context()
+    stages = instrumentation.Stages(
+        run, os.path.join('outputs', 'train_stages.json'))
     run.tag('data_folder',
             utils.last_two_folders_if_exists(args.data_folder))
 
+    if args.stream_chunk_size > 0:
+        run.tag('stream_chunk_size', args.stream_chunk_size)
+        with stages.stage('train_model_streaming') as stage:
+            model, rmse, mape, n_rows = train_model_streaming(
+                args.data_folder, args.stream_chunk_size,
+                spatial=args.spatial_features,
+                rounds_per_chunk=args.stream_rounds_per_chunk)
+            stage.rows = n_rows
+        run.log('train_rows', n_rows)
+        run.log('rmse', rmse)
+        run.log('mape', mape)
+        save_model(run, model, args.compile_model)
+        return
+
     # read and process data
     # df = utils.read_raw_data(data_folder)
     # df = utils.process_raw_data(df)
-    df = utils.read_train_data(args.data_folder)
-    x_train, x_test, y_train, y_test = split_data(df)
+    with stages.stage('read_train_data') as stage:
+        df = utils.read_train_data(args.data_folder)
+        if args.spatial_features:
+            df = utils.add_spatial_features(df)
+        df = utils.downcast_train_data(df)
+        stage.rows = len(df)
+    if (args.cv_folds > 0 and args.cv_mode == 'rolling' and
+            utils.month_index_column not in df):
+        raise ValueError(
+            'rolling cross validation needs the {} column, rerun data prep '
+            'or use --cv_mode kfold'.format(utils.month_index_column))
+    run.tag('spatial_features', args.spatial_features)
+    memory_mb, memory_mb_64bit = utils.memory_usage_mb(df)
+    run.log('train_data_memory_mb_64bit', memory_mb_64bit)
+    run.log('train_data_memory_mb', memory_mb)
+    with stages.stage('split_data', rows=len(df)):
+        x, y, feature_names, train_idx, test_idx = split_data(df)
+    month_index = None
+    if utils.month_index_column in df:
+        month_index = df[utils.month_index_column].values.copy()
+    # the feature matrix holds all the data from here on
+    del df
+
+    folds = []
+    if args.cv_folds > 0:
+        if args.cv_mode == 'rolling':
+            folds = rolling_month_folds(
+                month_index, args.cv_folds, args.cv_window)
+        else:
+            folds = kfold_folds(len(y), args.cv_folds)
+        if not folds:
+            raise ValueError(
+                'rolling cross validation needs at least 2 distinct months, '
+                'use --cv_mode kfold')
+        # fewer rolling folds than cv_folds if there are fewer months
+        run.log('cv_folds_built', len(folds))
+
+    binary_path = args.dataset_binary
+    if binary_path is None and args.dataset_cache_dir:
+        binary_path = dataset_cache_path(
+            args.dataset_cache_dir, args.data_folder, feature_names)
+    cache_hit = binary_path is not None and os.path.isfile(binary_path)
+    start = time.perf_counter()
+    with stages.stage('build_dataset', rows=len(y)):
+        dataset = build_dataset(x, y, feature_names, binary_path)
+    run.log('dataset_cache_hit', int(cache_hit))
+    run.log('dataset_construct_seconds', time.perf_counter() - start)
 
-    model, rmse, mape = train_model(x_train, x_test, y_train, y_test)
+    params = default_params
+    num_boost_round = 20
+    if args.search_trials > 0:
+        search_train_idx, valid_idx = split_validation(train_idx)
+        with stages.stage('search_params', rows=len(search_train_idx)):
+            results, params, num_boost_round = search_params(
+                dataset, x, y, search_train_idx, valid_idx,
+                args.search_trials, max_workers=args.search_workers,
+                max_rounds=args.search_max_rounds)
+        for result in results:
+            run.log_row('search_trial', **result)
+        # results has a row per rung, every trial counts once
+        run.log('search_trials',
+                len({result['trial'] for result in results}))
+        for name in search_space:
+            run.tag('param_' + name, params[name])
+
+    if folds:
+        with stages.stage('cross_validate', rows=len(y)):
+            results = cross_validate(dataset, x, y, folds,
+                                     params=params,
+                                     num_boost_round=num_boost_round)
+        for result in results:
+            run.log_row('cv_fold', **result)
+        run.tag('cv_mode', args.cv_mode)
+        run.log('cv_rmse_mean', np.mean([r['rmse'] for r in results]))
+        run.log('cv_rmse_std', np.std([r['rmse'] for r in results]))
+        run.log('cv_mape_mean', np.mean([r['mape'] for r in results]))
+
+    with stages.stage('train_model', rows=len(train_idx)):
+        model, rmse, mape = train_model(dataset, x, y, train_idx, test_idx,
+                                        params=params,
+                                        num_boost_round=num_boost_round)
     run.log('rmse', rmse)
     run.log('mape', mape)
 
+    save_model(run, model, args.compile_model)
+
+
+def save_model(run, model, compile_model=False):
     # save the model
-    os.makedirs('outputs', exist_ok=True)
-    model_file = os.path.join('outputs', consts.model_name)
-    run.tag('model_file', model_file)
-    joblib.dump(value=model, filename=model_file)
+    model_files = model_io.export_model(
+        model, consts.model_output_folder, compile_model=compile_model)
+    run.tag('model_file', model_files[0])
+    run.tag('model_folder', consts.model_output_folder)
 
 
 if __name__ == '__main__':
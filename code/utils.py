@@ -1,8 +1,16 @@
 import numpy as np
 import pandas as pd
 import os
+import re
 import glob
+import json
+import shutil
+import hashlib
+from functools import lru_cache
+from concurrent.futures import ProcessPoolExecutor
+from itertools import repeat
 from pathlib import Path
+from pandas.api.types import union_categoricals
 
 min_latitude = 40.53
 max_latitude = 40.88
@@ -12,107 +20,770 @@ min_distance = 0.25
 max_distance = 31
 max_duration = 180  # minutes
 
+ns_per_second = 10 ** 9
+ns_per_hour = 3600 * ns_per_second
+seconds_per_day = 86400
+ns_per_day = seconds_per_day * ns_per_second
+nat_ns = np.iinfo(np.int64).min  # NaT as int64 nanoseconds
 
-def build_features(s):
+# explicit schema of the raw green taxi csv files, so that pandas doesn't
+# have to infer types and every column is stored in the narrowest type;
+# integer columns can be blank in the raw data and are read as float32,
+# process_raw_data drops the blank rows and converts to train_dtypes
+raw_datetime_columns = ['lpepPickupDatetime', 'lpepDropoffDatetime']
+raw_datetime_format = '%Y-%m-%d %H:%M:%S'
+raw_dtypes = {
+    'vendorID': 'float32',
+    'passengerCount': 'float32',
+    'tripDistance': 'float32',
+    'puLocationId': 'float32',
+    'doLocationId': 'float32',
+    'pickupLongitude': 'float32',
+    'pickupLatitude': 'float32',
+    'dropoffLongitude': 'float32',
+    'dropoffLatitude': 'float32',
+    'rateCodeID': 'float32',
+    'storeAndFwdFlag': 'category',
+    'paymentType': 'float32',
+    'fareAmount': 'float32',
+    'extra': 'float32',
+    'mtaTax': 'float32',
+    'improvementSurcharge': 'float32',
+    'tipAmount': 'float32',
+    'tollsAmount': 'float32',
+    'ehailFee': 'float32',
+    'totalAmount': 'float32',
+    'tripType': 'float32'}
+# raw columns that process_raw_data needs, everything else is dropped
+raw_columns_used = [
+    'vendorID', 'lpepPickupDatetime', 'lpepDropoffDatetime',
+    'passengerCount', 'tripDistance', 'pickupLongitude', 'pickupLatitude',
+    'dropoffLongitude', 'dropoffLatitude', 'totalAmount']
+
+# columns of the processed training data, in the order the model expects
+feature_columns = [
+    'vendorID', 'passengerCount', 'tripDistance', 'pickupLongitude',
+    'pickupLatitude', 'dropoffLongitude', 'dropoffLatitude', 'totalAmount',
+    'month_num', 'day_of_month', 'day_of_week', 'hour_of_day']
+label_column = 'duration'
+train_columns = feature_columns + [label_column]
+# year * 12 + month of the pickup, data prep writes it for time aware
+# cross validation, it isn't a model feature
+month_index_column = 'month_index'
+coordinate_columns = [
+    'pickupLongitude', 'pickupLatitude', 'dropoffLongitude',
+    'dropoffLatitude']
+# categorical features of the model
+categorical_columns = [
+    'vendorID', 'month_num', 'day_of_month', 'day_of_week', 'hour_of_day',
+    'pickup_cell', 'dropoff_cell']
+# optional spatial features over a grid of the valid coordinate range
+grid_cells_per_side = 32
+earth_radius_miles = 3958.8
+spatial_feature_columns = [
+    'pickup_cell', 'dropoff_cell', 'cell_pair', 'haversine_distance']
+# compact types of the processed training data
+train_dtypes = {
+    'vendorID': 'int8',
+    'passengerCount': 'int8',
+    'tripDistance': 'float32',
+    'pickupLongitude': 'float32',
+    'pickupLatitude': 'float32',
+    'dropoffLongitude': 'float32',
+    'dropoffLatitude': 'float32',
+    'totalAmount': 'float32',
+    'month_num': 'int8',
+    'day_of_month': 'int8',
+    'day_of_week': 'int8',
+    'hour_of_day': 'int8',
+    'duration': 'int16',
+    'month_index': 'int16',
+    'pickup_cell': 'int16',
+    'dropoff_cell': 'int16',
+    'cell_pair': 'int32',
+    'haversine_distance': 'float32'}
+# processed parquet data is partitioned into month_num=<n> folders
+partition_column = 'month_num'
+# raw columns that aren't used as features
+raw_columns_removed = [
+    "lpepPickupDatetime", "lpepDropoffDatetime", "puLocationId",
+    "doLocationId", "extra", "mtaTax", "improvementSurcharge",
+    "tollsAmount", "ehailFee", "tripType", "rateCodeID",
+    "storeAndFwdFlag", "paymentType", "fareAmount", "tipAmount"]
+# incremental data prep keeps track of processed raw files in this file
+manifest_file_name = 'manifest.json'
+
+
+def list_raw_files(data_folder_or_file):
     """
-    Build additional features for the input row of a dataframe.
-    Returns the same row with additional feature columns.
+    Return the raw csv file, or all csv files under the raw data folder
+    in a stable order.
     """
-    s['month_num'] = s['lpepPickupDatetime'].month
-    s['day_of_month'] = s['lpepPickupDatetime'].day
-    s['day_of_week'] = s['lpepPickupDatetime'].weekday()
-    s['hour_of_day'] = s['lpepPickupDatetime'].hour
-    s['duration'] = (
-        (s['lpepDropoffDatetime'] - s['lpepPickupDatetime']).seconds // 60)
-    return s
+    if os.path.isfile(data_folder_or_file):
+        return [data_folder_or_file]
+    return sorted(glob.glob(os.path.join(data_folder_or_file, '**/*.csv'),
+                            recursive=True))
+
+
+def _raw_read_options(file_path, usecols=None):
+    """
+    Build pd.read_csv options for a raw file with the pinned raw schema.
+    Projected columns are resolved to positions so that the unnamed
+    index column stays the index.
+    """
+    options = {
+        'index_col': 0,
+        'dtype': raw_dtypes,
+        'low_memory': False}
+    if usecols is not None:
+        header = pd.read_csv(file_path, nrows=0).columns
+        options['usecols'] = [0] + [
+            i for i, col in enumerate(header) if col in usecols]
+    return options
+
+
+def _parse_raw_datetimes(df):
+    for col in raw_datetime_columns:
+        if col in df:
+            df[col] = pd.to_datetime(df[col], format=raw_datetime_format)
+    return df
+
+
+def _read_raw_file(file_path, usecols=None):
+    """
+    Read a single raw csv file with the pinned raw schema.
+    Returns the index and a dict of independent column arrays, so that
+    the caller can free each file's column as soon as it is assembled.
+    """
+    df = pd.read_csv(file_path, **_raw_read_options(file_path, usecols))
+    df = _parse_raw_datetimes(df)
+    columns = {col: df[col].values for col in df.columns}
+    return df.index.values, columns
 
 
-def read_raw_data(data_folder_or_file):
+def _assemble_raw_columns(parts):
+    """
+    Assemble per-file column arrays column by column. Each file's copy of
+    a column is released right after it's concatenated, so peak memory is
+    the data plus one column rather than every frame plus a full concat.
+    """
+    index = np.concatenate([part[0] for part in parts])
+    column_names = list(parts[0][1].keys())
+    data = {}
+    for col in column_names:
+        pieces = [part[1].pop(col) for part in parts]
+        if isinstance(pieces[0], pd.Categorical):
+            data[col] = union_categoricals(pieces)
+        else:
+            data[col] = np.concatenate(pieces)
+        del pieces
+    return pd.DataFrame(data, index=index, columns=column_names, copy=False)
+
+
+def read_raw_data(data_folder_or_file, usecols=None, max_workers=None):
     """
     Read all csv files from data/input folder and concat to
-    return a single dataframe
+    return a single dataframe.
+    Files are parsed concurrently in a process pool with the pinned
+    raw_dtypes schema. Pass usecols (e.g. raw_columns_used) to only read
+    the columns that process_raw_data keeps.
     """
+    all_files = list_raw_files(data_folder_or_file)
     if os.path.isfile(data_folder_or_file):
         print("Reading raw data file {}".format(data_folder_or_file))
-        df = pd.read_csv(
-            data_folder_or_file,
-            index_col=0,
-            parse_dates=['lpepPickupDatetime', 'lpepDropoffDatetime'],
-            infer_datetime_format=True)
     else:
-        print("Reading files in raw data folder {}"
-              .format(data_folder_or_file))
-        all_files = glob.glob(os.path.join(data_folder_or_file, '**/*.csv'),
-                              recursive=True)
-        df_list = []
-        for f in all_files:
-            df_from_each_file = pd.read_csv(
-                f,
-                index_col=0,
-                parse_dates=['lpepPickupDatetime', 'lpepDropoffDatetime'],
-                infer_datetime_format=True)
-            df_list.append(df_from_each_file)
-
-        df = pd.concat(df_list)
-    return df
+        print("Reading {} files in raw data folder {}"
+              .format(len(all_files), data_folder_or_file))
+
+    if len(all_files) == 1 or max_workers == 1:
+        parts = [_read_raw_file(f, usecols) for f in all_files]
+    else:
+        with ProcessPoolExecutor(max_workers=max_workers) as executor:
+            parts = list(executor.map(
+                _read_raw_file, all_files, repeat(usecols)))
+
+    return _assemble_raw_columns(parts)
+
+
+def iter_raw_data(data_folder_or_file, chunksize, usecols=None):
+    """
+    Yield the raw data file by file in chunks of at most chunksize rows,
+    parsed with the same pinned schema as read_raw_data.
+    """
+    for f in list_raw_files(data_folder_or_file):
+        print("Streaming raw data file {}".format(f))
+        reader = pd.read_csv(
+            f, chunksize=chunksize, **_raw_read_options(f, usecols))
+        for chunk in reader:
+            yield _parse_raw_datetimes(chunk)
+
+
+def _days_to_date(days):
+    """
+    Convert int64 days since 1970-01-01 to year, month and day of month
+    with integer arithmetic only (Howard Hinnant's civil_from_days), so
+    no datetime objects or .dt accessors are involved.
+    """
+    z = days + 719468
+    era = z // 146097
+    doe = z - era * 146097
+    yoe = (doe - doe // 1460 + doe // 36524 - doe // 146096) // 365
+    doy = doe - (365 * yoe + yoe // 4 - yoe // 100)
+    mp = (5 * doy + 2) // 153
+    day = doy - (153 * mp + 2) // 5 + 1
+    month = np.where(mp < 10, mp + 3, mp - 9)
+    year = yoe + era * 400 + (month <= 2)
+    return year, month, day
+
+
+def _datetime_ns(values):
+    """
+    Return int64 nanoseconds since epoch of datetime-like values,
+    e.g. a datetime64 Series or array, or a list of timestamp strings.
+    """
+    values = np.asarray(values)
+    if values.dtype.kind != 'M':
+        values = pd.to_datetime(values).values
+    return values.astype('datetime64[ns]').view('int64')
+
+
+def _duration_minutes(pickup_ns, dropoff_ns):
+    # same as timedelta.seconds // 60, which ignores the days component
+    return (((dropoff_ns - pickup_ns) // ns_per_second)
+            % seconds_per_day) // 60
+
+
+def build_features_batch(pickup, dropoff=None):
+    """
+    Build the additional features for a batch of trips at once.
+    pickup is either a dataframe with lpepPickupDatetime and, optionally,
+    lpepDropoffDatetime columns, or datetime64 values of the pickup times
+    with the dropoff times passed separately.
+    Returns a dataframe with month_num, day_of_month, day_of_week and
+    hour_of_day, plus duration when dropoff times are given.
+    This is the one code path for datetime features of data prep, the
+    row-wise build_features delegates to it.
+    """
+    index = None
+    if isinstance(pickup, pd.DataFrame):
+        dropoff = pickup.get('lpepDropoffDatetime')
+        pickup = pickup['lpepPickupDatetime']
+    if isinstance(pickup, pd.Series):
+        index = pickup.index
+    pickup_ns = _datetime_ns(pickup)
+    days = pickup_ns // ns_per_day
+    _, month, day = _days_to_date(days)
+    features = {
+        'month_num': month,
+        'day_of_month': day,
+        # 1970-01-01 was a Thursday, weekday 3 counting from Monday
+        'day_of_week': (days + 3) % 7,
+        'hour_of_day': (pickup_ns % ns_per_day) // ns_per_hour}
+    if dropoff is not None:
+        features['duration'] = _duration_minutes(
+            pickup_ns, _datetime_ns(dropoff))
+    features = {col: values.astype(train_dtypes[col])
+                for col, values in features.items()}
+    return pd.DataFrame(features, index=index, columns=list(features))
+
+
+def build_features(s):
+    """
+    Build additional features for the input row of a dataframe.
+    Returns the same row with additional feature columns.
+    Applying this row by row is slow, use build_features_batch on the
+    whole dataframe instead.
+    """
+    features = build_features_batch(
+        [s['lpepPickupDatetime']], [s['lpepDropoffDatetime']])
+    for col in features.columns:
+        s[col] = features[col].values[0]
+    return s
+
+
+@lru_cache(maxsize=None)
+def spatial_grid(cells_per_side=grid_cells_per_side):
+    """
+    Precompute the grid over the valid coordinate range: its origin and
+    the scale from degrees to cell index along each axis, so mapping a
+    coordinate to its cell is plain array arithmetic.
+    """
+    longitude_scale = cells_per_side / (max_longitude - min_longitude)
+    latitude_scale = cells_per_side / (max_latitude - min_latitude)
+    return min_longitude, min_latitude, longitude_scale, latitude_scale
+
+
+def _grid_cell(longitude, latitude, cells_per_side):
+    origin_longitude, origin_latitude, longitude_scale, latitude_scale = \
+        spatial_grid(cells_per_side)
+    column = np.clip(
+        ((np.asarray(longitude, dtype=np.float64) - origin_longitude)
+         * longitude_scale).astype(np.int64), 0, cells_per_side - 1)
+    row = np.clip(
+        ((np.asarray(latitude, dtype=np.float64) - origin_latitude)
+         * latitude_scale).astype(np.int64), 0, cells_per_side - 1)
+    return row * cells_per_side + column
+
+
+def _haversine_miles(longitude1, latitude1, longitude2, latitude2):
+    longitude1, latitude1, longitude2, latitude2 = (
+        np.radians(np.asarray(v, dtype=np.float64))
+        for v in (longitude1, latitude1, longitude2, latitude2))
+    a = (np.sin((latitude2 - latitude1) / 2) ** 2
+         + np.cos(latitude1) * np.cos(latitude2)
+         * np.sin((longitude2 - longitude1) / 2) ** 2)
+    return 2 * earth_radius_miles * np.arcsin(np.sqrt(a))
+
+
+def build_spatial_features(pickup_longitude, pickup_latitude,
+                           dropoff_longitude, dropoff_latitude,
+                           cells_per_side=grid_cells_per_side):
+    """
+    Map pickup and dropoff coordinates to cells of a grid over the valid
+    coordinate range, and compute the id of the cell pair and the
+    haversine distance in miles. Coordinates outside of the range are
+    mapped to the border cells.
+    Returns a dict of arrays named by spatial_feature_columns.
+    """
+    pickup_cell = _grid_cell(
+        pickup_longitude, pickup_latitude, cells_per_side)
+    dropoff_cell = _grid_cell(
+        dropoff_longitude, dropoff_latitude, cells_per_side)
+    features = {
+        'pickup_cell': pickup_cell,
+        'dropoff_cell': dropoff_cell,
+        'cell_pair': pickup_cell * cells_per_side ** 2 + dropoff_cell,
+        'haversine_distance': _haversine_miles(
+            pickup_longitude, pickup_latitude,
+            dropoff_longitude, dropoff_latitude)}
+    return {col: values.astype(train_dtypes[col])
+            for col, values in features.items()}
+
+
+def add_spatial_features(df, cells_per_side=grid_cells_per_side):
+    """
+    Return the processed data with spatial features added, unless it
+    already has them.
+    """
+    if all(col in df for col in spatial_feature_columns):
+        return df
+    features = build_spatial_features(
+        df['pickupLongitude'].values, df['pickupLatitude'].values,
+        df['dropoffLongitude'].values, df['dropoffLatitude'].values,
+        cells_per_side)
+    return df.assign(**features)
+
+
+def add_spatial_features_to_matrix(x, cells_per_side=grid_cells_per_side):
+    """
+    Append spatial features to a matrix of rows in feature_columns order,
+    as sent to the scoring service.
+    """
+    x = np.asarray(x)
+    coordinates = [x[:, feature_columns.index(col)]
+                   for col in coordinate_columns]
+    features = build_spatial_features(*coordinates, cells_per_side)
+    return np.column_stack(
+        [x] + [features[col] for col in spatial_feature_columns])
 
 
-def process_raw_data(df):
+def process_raw_data(df, spatial=False):
     """
     Fileter raw data to valid range,
     build additional features,
     filter again additional features to valid range,
     remove unused columns.
+    The range filters and the duration filter are combined into a single
+    mask, datetime features are built by build_features_batch for the
+    kept rows only, and every kept column is taken exactly once.
+    Features are built in the compact train_dtypes. The month_index
+    column after the label orders the rows by month across years.
+    With spatial, grid cell and distance features are added as well.
     """
-    df = df.loc[
-            (df.pickupLatitude >= min_latitude) &
-            (df.pickupLatitude <= max_latitude) &
-            (df.pickupLongitude >= min_longitude) &
-            (df.pickupLongitude <= max_longitude) &
-            (df.tripDistance >= min_distance) &
-            (df.tripDistance < max_distance) &
-            (df.passengerCount > 0) &
-            (df.totalAmount > 0)]
-    pd.options.mode.chained_assignment = None
-    df['month_num'] = df.lpepPickupDatetime.dt.month
-    df['day_of_month'] = df.lpepPickupDatetime.dt.day
-    df['day_of_week'] = df.lpepPickupDatetime.dt.weekday
-    df['hour_of_day'] = df.lpepPickupDatetime.dt.hour
-    df['duration'] = (
-        (df.lpepDropoffDatetime - df.lpepPickupDatetime).dt.seconds // 60)
-    df = df.loc[(df.duration < max_duration)]
-
-    columns_to_remove = [
-        "lpepPickupDatetime", "lpepDropoffDatetime", "puLocationId",
-        "doLocationId", "extra", "mtaTax", "improvementSurcharge",
-        "tollsAmount", "ehailFee", "tripType", "rateCodeID",
-        "storeAndFwdFlag", "paymentType", "fareAmount", "tipAmount"]
-    for col in columns_to_remove:
-        df.pop(col)
+    pickup_ns = df['lpepPickupDatetime'].values.view('int64')
+    dropoff_ns = df['lpepDropoffDatetime'].values.view('int64')
+    duration = _duration_minutes(pickup_ns, dropoff_ns)
 
-    return df
+    pickup_latitude = df['pickupLatitude'].values
+    pickup_longitude = df['pickupLongitude'].values
+    trip_distance = df['tripDistance'].values
+    mask = pickup_latitude >= min_latitude
+    mask &= pickup_latitude <= max_latitude
+    mask &= pickup_longitude >= min_longitude
+    mask &= pickup_longitude <= max_longitude
+    mask &= trip_distance >= min_distance
+    mask &= trip_distance < max_distance
+    mask &= ~np.isnan(df['vendorID'].values)
+    mask &= df['passengerCount'].values > 0
+    mask &= df['totalAmount'].values > 0
+    mask &= pickup_ns != nat_ns
+    mask &= dropoff_ns != nat_ns
+    mask &= duration < max_duration
+    rows = np.flatnonzero(mask)
+
+    features = build_features_batch(
+        pickup_ns[rows].view('datetime64[ns]'))
+    data = {col: df[col].values[rows].astype(
+                train_dtypes.get(col, df[col].dtype), copy=False)
+            for col in df.columns if col not in raw_columns_removed}
+    for col in features.columns:
+        data[col] = features[col].values
+    if spatial:
+        data.update(build_spatial_features(
+            data['pickupLongitude'], data['pickupLatitude'],
+            data['dropoffLongitude'], data['dropoffLatitude']))
+    data['duration'] = duration[rows].astype(train_dtypes['duration'])
+    year, month, _ = _days_to_date(pickup_ns[rows] // ns_per_day)
+    data[month_index_column] = (year * 12 + month).astype(
+        train_dtypes[month_index_column])
+    return pd.DataFrame(data, index=df.index[rows], columns=list(data))
 
 
-def write_train_data(df, file_path, file_name):
+def write_train_data(df, file_path, file_name, append=False,
+                     file_format='csv'):
     """
     Read all csv files from input folder and concat to return a single
     dataframe. To detect data drift, the input data to web service doesn't
     have an index column, if the training data has index column, it will
     cause mismatch error. So avoid writing index column.
+    With append, rows are added to an existing file without a header.
+    With file_format 'parquet', the data is written to a folder named
+    after file_name without extension, as snappy compressed parquet files
+    partitioned by month_num with float32 coordinates. Appending adds new
+    files to the partitions. 'both' writes the parquet folder and the csv
+    file, the latter for the data drift detection dataset.
     """
     Path(file_path).mkdir(parents=True, exist_ok=True)
-    df.to_csv(path_or_buf=os.path.join(file_path, file_name), index=False)
+    if file_format in ('parquet', 'both'):
+        dataset_folder = os.path.splitext(file_name)[0]
+        df_parquet = df.astype(
+            {col: 'float32' for col in coordinate_columns if col in df})
+        df_parquet.to_parquet(
+            os.path.join(file_path, dataset_folder), engine='pyarrow',
+            compression='snappy', index=False,
+            partition_cols=[partition_column])
+    if file_format in ('csv', 'both'):
+        df.to_csv(path_or_buf=os.path.join(file_path, file_name),
+                  index=False, mode='a' if append else 'w',
+                  header=not append)
     return
 
 
-def read_train_data(data_folder):
+def process_raw_data_in_chunks(data_folder_or_file, file_path, file_name,
+                               chunksize, usecols=raw_columns_used,
+                               file_format='csv', spatial=False):
+    """
+    Stream raw data through process_raw_data and write_train_data chunk
+    by chunk, so peak memory depends on chunksize rather than on the
+    volume of raw data. Every step is row-wise, so the output is the
+    same as processing all raw data at once.
+    Returns the shape of the processed data.
+    """
+    n_rows = 0
+    n_columns = 0
+    chunks = iter_raw_data(data_folder_or_file, chunksize, usecols)
+    for i, chunk in enumerate(chunks):
+        df = process_raw_data(chunk, spatial=spatial)
+        write_train_data(df, file_path, file_name, append=i > 0,
+                         file_format=file_format)
+        n_rows += df.shape[0]
+        n_columns = df.shape[1]
+    return n_rows, n_columns
+
+
+def _file_md5(file_path):
+    md5 = hashlib.md5()
+    with open(file_path, 'rb') as f:
+        for block in iter(lambda: f.read(1 << 20), b''):
+            md5.update(block)
+    return md5.hexdigest()
+
+
+def file_signature(file_path, use_hash=False):
+    """
+    Return size and modification time of a file, plus the md5 of its
+    content if use_hash is set, to tell whether it changed, e.g. a raw
+    file since the last data prep.
+    """
+    stat = os.stat(file_path)
+    signature = {'size': stat.st_size, 'mtime': stat.st_mtime}
+    if use_hash:
+        signature['md5'] = _file_md5(file_path)
+    return signature
+
+
+def load_manifest(processed_folder):
+    """
+    Load the manifest of an incrementally processed folder, which maps
+    each raw file to its signature and output partition.
+    Returns an empty manifest if the folder wasn't processed
+    incrementally.
+    """
+    manifest_path = os.path.join(processed_folder, manifest_file_name)
+    if not os.path.isfile(manifest_path):
+        return {}
+    with open(manifest_path) as f:
+        return json.load(f)
+
+
+def save_manifest(processed_folder, manifest):
+    """
+    Write the manifest through a temporary file, so an interrupted run
+    never leaves a truncated manifest behind.
+    """
+    Path(processed_folder).mkdir(parents=True, exist_ok=True)
+    manifest_path = os.path.join(processed_folder, manifest_file_name)
+    with open(manifest_path + '.tmp', 'w') as f:
+        json.dump(manifest, f, indent=2, sort_keys=True)
+    os.replace(manifest_path + '.tmp', manifest_path)
+
+
+def _remove_partition(processed_folder, output):
+    output_path = os.path.join(processed_folder, output)
+    if os.path.isdir(output_path):
+        shutil.rmtree(output_path)
+    if os.path.isfile(output_path + '.csv'):
+        os.remove(output_path + '.csv')
+
+
+def process_raw_data_incrementally(raw_folder, processed_folder,
+                                   chunksize=0, file_format='csv',
+                                   use_hash=False, max_workers=None,
+                                   spatial=False):
+    """
+    Only process raw files that are new or changed since the last run,
+    according to the manifest in the processed folder. Each raw file gets
+    its own output partition, named after its path in the raw folder, so
+    partitions of unchanged files are reused and those of removed files
+    are deleted. Partitions built with different spatial features or in
+    a different file format are rebuilt.
+    Returns the number of processed, reused and removed raw files, and
+    the shape of the newly processed data.
+    """
+    manifest = load_manifest(processed_folder)
+    raw_files = {
+        os.path.relpath(f, raw_folder).replace(os.sep, '/'): f
+        for f in list_raw_files(raw_folder)}
+
+    removed = [key for key in manifest if key not in raw_files]
+    for key in removed:
+        _remove_partition(processed_folder, manifest.pop(key)['output'])
+
+    n_rows = 0
+    n_columns = 0
+    processed = []
+    for key, raw_file in sorted(raw_files.items()):
+        signature = file_signature(raw_file, use_hash)
+        entry = manifest.get(key)
+        if (entry is not None and entry['signature'] == signature
+                and entry.get('spatial', False) == spatial
+                and entry.get('file_format', 'csv') == file_format):
+            continue
+        output = os.path.splitext(key)[0].replace('/', '_')
+        if entry is not None:
+            _remove_partition(processed_folder, entry['output'])
+        if chunksize > 0:
+            shape = process_raw_data_in_chunks(
+                raw_file, processed_folder, output + '.csv', chunksize,
+                file_format=file_format, spatial=spatial)
+        else:
+            df = process_raw_data(read_raw_data(
+                raw_file, usecols=raw_columns_used,
+                max_workers=max_workers), spatial=spatial)
+            write_train_data(df, processed_folder, output + '.csv',
+                             file_format=file_format)
+            shape = df.shape
+        n_rows += shape[0]
+        n_columns = shape[1]
+        manifest[key] = {
+            'signature': signature, 'output': output, 'spatial': spatial,
+            'file_format': file_format}
+        processed.append(key)
+        # save after every file so an interrupted run keeps its progress
+        save_manifest(processed_folder, manifest)
+
+    save_manifest(processed_folder, manifest)
+    n_reused = len(raw_files) - len(processed)
+    return len(processed), n_reused, len(removed), (n_rows, n_columns)
+
+
+def _parquet_dataset_folder(file_path):
+    folder = os.path.dirname(file_path)
+    while re.match(r'{}=\d+$'.format(partition_column),
+                   os.path.basename(folder)):
+        folder = os.path.dirname(folder)
+    return folder
+
+
+def _prefer_parquet(files):
+    # <name>.csv is the csv copy of the parquet dataset in <name>/
+    parquet_folders = {_parquet_dataset_folder(f) for f in files
+                       if f.endswith('.parquet')}
+    return [f for f in files if f.endswith('.parquet') or (
+        f.endswith('.csv') and
+        os.path.splitext(f)[0] not in parquet_folders)]
+
+
+def list_train_files(data_folder):
+    """
+    Return the processed training files under the folder in a stable
+    order. A parquet dataset takes precedence over the csv file of the
+    same name, so csv copies for data drift detection aren't read twice,
+    while csv files without a parquet copy are still read.
+    If the folder has a manifest, only the partitions it lists are read.
+    """
+    manifest = load_manifest(data_folder)
+    if manifest:
+        all_files = []
+        for entry in manifest.values():
+            output_path = os.path.join(data_folder, entry['output'])
+            all_files += glob.glob(
+                os.path.join(output_path, '**/*.parquet'), recursive=True)
+            all_files += glob.glob(output_path + '.csv')
+    else:
+        all_files = glob.glob(os.path.join(data_folder, '**/*.parquet'),
+                              recursive=True)
+        all_files += glob.glob(os.path.join(data_folder, '**/*.csv'),
+                               recursive=True)
+    return sorted(_prefer_parquet(
+        [f for f in all_files if os.path.isfile(f)]))
+
+
+def _read_parquet_file(file_path, columns=None, row_group=None):
+    """
+    Read a single parquet partition file, or one row group of it, with
+    column projection, restoring the partition column from its
+    month_num=<n> folder.
+    """
+    import pyarrow.parquet as pq
+
+    partition = re.search(
+        r'{}=(\d+)'.format(partition_column), file_path)
+    file_columns = columns
+    if columns is not None:
+        file_columns = [col for col in columns if col != partition_column]
+    parquet_file = pq.ParquetFile(file_path)
+    if row_group is None:
+        table = parquet_file.read(columns=file_columns)
+    else:
+        table = parquet_file.read_row_group(row_group, columns=file_columns)
+    df = table.to_pandas()
+    if partition is not None and (
+            columns is None or partition_column in columns):
+        df[partition_column] = np.int64(partition.group(1))
+    return df
+
+
+def _combine_chunks(frames, chunksize):
+    """
+    Regroup a stream of dataframes into chunks of chunksize rows, only
+    the last chunk can be smaller.
+    """
+    pending = []
+    n_pending = 0
+    for df in frames:
+        start = 0
+        while n_pending + len(df) - start >= chunksize:
+            end = start + chunksize - n_pending
+            pending.append(df.iloc[start:end])
+            yield pending[0] if len(pending) == 1 else pd.concat(
+                pending, ignore_index=True)
+            pending = []
+            n_pending = 0
+            start = end
+        if start < len(df):
+            pending.append(df.iloc[start:])
+            n_pending += len(df) - start
+    if pending:
+        yield pending[0] if len(pending) == 1 else pd.concat(
+            pending, ignore_index=True)
+
+
+def _iter_train_files(data_folder, chunksize, columns=None):
+    import pyarrow.parquet as pq
+
+    for f in list_train_files(data_folder):
+        if f.endswith('.parquet'):
+            for i in range(pq.ParquetFile(f).num_row_groups):
+                yield downcast_train_data(_train_column_order(
+                    _read_parquet_file(f, columns, row_group=i)))
+        else:
+            reader = pd.read_csv(f, index_col=None, usecols=columns,
+                                 dtype=train_dtypes, chunksize=chunksize)
+            for chunk in reader:
+                yield _train_column_order(chunk)
+
+
+def iter_train_data(data_folder, chunksize, columns=None):
+    """
+    Yield the training data read by read_train_data in chunks of
+    chunksize rows, so it never has to fit in memory. Parquet files are
+    read one row group at a time, and row groups and files are combined
+    so every chunk but the last has chunksize rows.
+    """
+    return _combine_chunks(
+        _iter_train_files(data_folder, chunksize, columns), chunksize)
+
+
+def feature_matrix(df, feature_names):
+    """
+    Build the float32 matrix of the feature columns. The matrix is column
+    major, so every column is filled with one contiguous copy and
+    lightgbm reads it without converting.
+    """
+    x = np.empty((len(df), len(feature_names)), dtype=np.float32, order='F')
+    for i, col in enumerate(feature_names):
+        x[:, i] = df[col].values
+    return x
+
+
+def downcast_train_data(df):
+    """
+    Convert the columns of the training data to the compact train_dtypes,
+    one column at a time so the data is never copied as a whole.
+    """
+    for col, dtype in train_dtypes.items():
+        if col in df and df[col].dtype != dtype:
+            df[col] = df[col].astype(dtype)
+    return df
+
+
+def memory_usage_mb(df):
+    """
+    Return the memory used by the dataframe and, to compare with, the
+    memory it would use with every column as 64 bit float or int.
+    """
+    actual = df.memory_usage(index=True, deep=True).sum()
+    wide = df.memory_usage(index=True, deep=False).loc['Index'] + \
+        8 * df.shape[0] * df.shape[1]
+    return actual / 2 ** 20, wide / 2 ** 20
+
+
+def _train_column_order(df):
+    ordered = [col for col in train_columns if col in df]
+    return df[ordered + [col for col in df.columns if col not in ordered]]
+
+
+def read_train_data(data_folder, columns=None):
     """
     Read all csv files from input folder and concat to return a single
     dataframe. Training data doesn't include index column.
+    Partitioned parquet data is read instead when present. Pass columns
+    to only read a subset of the columns. Columns are read in the compact
+    train_dtypes.
     """
-    all_files = glob.glob(os.path.join(data_folder, '**/*.csv'),
-                          recursive=True)
-    df_from_each_file = (pd.read_csv(f, index_col=None) for f in all_files)
+    all_files = list_train_files(data_folder)
+    if any(f.endswith('.parquet') for f in all_files):
+        df_from_each_file = (
+            _read_parquet_file(f, columns) if f.endswith('.parquet')
+            else pd.read_csv(f, index_col=None, usecols=columns,
+                             dtype=train_dtypes)
+            for f in all_files)
+        df = pd.concat(df_from_each_file, ignore_index=True)
+        return downcast_train_data(_train_column_order(df))
+    df_from_each_file = (pd.read_csv(f, index_col=None, usecols=columns,
+                                     dtype=train_dtypes)
+                         for f in all_files)
     df = pd.concat(df_from_each_file)
     return df
 
@@ -1,6 +1,20 @@
+import os
+import sys
+import math
+import time
+import random
 import requests
 import json
 import argparse
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+CODE_PATH = '../code'
+sys.path.append(os.path.join(os.getcwd(), CODE_PATH))
+
+sample_row = [
+    1, 1, 1.00, -73.957909, 40.670761, -73.952194, 40.662312, 8.15, 1, 17,
+    5, 1]
 
 
 def main():
@@ -13,33 +27,209 @@ def main():
     parser.add_argument(
         '--token',
         type=str,
+        default=None,
         dest='token',
         help='auth token to access the service')
+    parser.add_argument(
+        '--load_test',
+        action='store_true',
+        dest='load_test',
+        help='drive the service with concurrent requests and check the slo')
+    parser.add_argument(
+        '--concurrency',
+        type=int,
+        default=8,
+        dest='concurrency',
+        help='number of concurrent clients of the load test')
+    parser.add_argument(
+        '--duration_seconds',
+        type=float,
+        default=30,
+        dest='duration_seconds',
+        help='how long the load test runs')
+    parser.add_argument(
+        '--batch_sizes',
+        type=int,
+        nargs='+',
+        default=[1, 10, 100],
+        dest='batch_sizes',
+        help='rows per request, each request picks one at random')
+    parser.add_argument(
+        '--data_folder',
+        type=str,
+        default=None,
+        dest='data_folder',
+        help='processed training data to sample request rows from')
+    parser.add_argument(
+        '--sample_rows',
+        type=int,
+        default=10000,
+        dest='sample_rows',
+        help='number of rows sampled from the training data')
+    parser.add_argument(
+        '--slo_p95_ms',
+        type=float,
+        default=None,
+        dest='slo_p95_ms',
+        help='fail if the p95 latency in ms is higher')
+    parser.add_argument(
+        '--slo_p99_ms',
+        type=float,
+        default=None,
+        dest='slo_p99_ms',
+        help='fail if the p99 latency in ms is higher')
+    parser.add_argument(
+        '--slo_error_rate',
+        type=float,
+        default=0.01,
+        dest='slo_error_rate',
+        help='fail if a larger fraction of the requests fails')
+    parser.add_argument(
+        '--slo_rows_per_second',
+        type=float,
+        default=None,
+        dest='slo_rows_per_second',
+        help='fail if fewer rows per second are scored')
 
     args = parser.parse_args()
     response = test_endpoint(args.uri, args.token)
     if response.status_code != 200:
         return 1
-    else:
+    if not args.load_test:
         return 0
 
+    rows = sample_request_rows(args.data_folder, args.sample_rows)
+    report = load_test(args.uri, args.token, rows, args.concurrency,
+                       args.duration_seconds, args.batch_sizes)
+    print(json.dumps(report, indent=2))
+    violations = check_slo(report, args.slo_p95_ms, args.slo_p99_ms,
+                           args.slo_error_rate, args.slo_rows_per_second)
+    for violation in violations:
+        print('slo violated: {}'.format(violation))
+    return 1 if violations else 0
+
+
+def request_headers(token):
+    headers = {'Content-Type': 'application/json'}
+    if token:
+        headers['Authorization'] = 'Bearer ' + token
+    return headers
+
 
 def test_endpoint(uri, token):
-    headers = {
-        'Content-Type': 'application/json',
-        'Authorization': 'Bearer ' + token
-        }
-    test_sample = json.dumps({'data': [
-        [1,1,1.00,-73.957909,40.670761,-73.952194,40.662312,8.15,1,17,5,1]  # noqa: E231, E501
-    ]})
+    test_sample = json.dumps({'data': [sample_row]})
     # test_sample = json.dumps({'data': score_df.values.tolist()})
 
-    response = requests.post(uri, data=test_sample, headers=headers)
+    response = requests.post(uri, data=test_sample,
+                             headers=request_headers(token))
     print(response.status_code)
     print(response.json())
     return response
 
 
+def sample_request_rows(data_folder, sample_rows, seed=0):
+    """
+    Sample feature rows of the processed training data to send in the
+    load test, or use the sample row if there's no data folder.
+    """
+    if data_folder is None:
+        return [sample_row]
+    import utils
+
+    df = utils.read_train_data(data_folder, columns=utils.feature_columns)
+    if len(df) > sample_rows:
+        df = df.sample(n=sample_rows, random_state=seed)
+    return df[utils.feature_columns].astype('float64').values.tolist()
+
+
+def percentile(sorted_values, q):
+    """
+    Nearest rank percentile of sorted values.
+    """
+    if not sorted_values:
+        return None
+    rank = max(int(math.ceil(q / 100.0 * len(sorted_values))), 1)
+    return sorted_values[min(rank, len(sorted_values)) - 1]
+
+
+def load_test(uri, token, rows, concurrency, duration_seconds, batch_sizes,
+              seed=0):
+    """
+    Send requests of rows sampled at random batch sizes from concurrent
+    clients for duration_seconds. Every client thread keeps its own
+    keep-alive connection. Returns latency percentiles in ms, rows and
+    requests per second and the error rate.
+    """
+    if not rows:
+        raise ValueError('no rows to send in the load test')
+    local = threading.local()
+    headers = request_headers(token)
+    deadline = time.perf_counter() + duration_seconds
+
+    def client(i):
+        local.session = requests.Session()
+        rng = random.Random(seed + i)
+        results = []
+        while time.perf_counter() < deadline:
+            batch_size = rng.choice(batch_sizes)
+            start = rng.randrange(len(rows))
+            batch = [rows[(start + j) % len(rows)]
+                     for j in range(batch_size)]
+            body = json.dumps({'data': batch})
+            started = time.perf_counter()
+            try:
+                response = local.session.post(uri, data=body,
+                                              headers=headers)
+                ok = response.status_code == 200
+                # scoring errors come back as a string instead of a list
+                ok = ok and isinstance(response.json(), (list, dict))
+            except (requests.RequestException, ValueError):
+                ok = False
+            results.append((time.perf_counter() - started, batch_size, ok))
+        local.session.close()
+        return results
+
+    started = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=concurrency) as executor:
+        results = [result for client_results in
+                   executor.map(client, range(concurrency))
+                   for result in client_results]
+    elapsed = time.perf_counter() - started
+
+    latencies = sorted(seconds * 1000 for seconds, _, ok in results if ok)
+    errors = sum(1 for _, _, ok in results if not ok)
+    scored_rows = sum(batch_size for _, batch_size, ok in results if ok)
+    return {
+        'requests': len(results),
+        'errors': errors,
+        'error_rate': errors / max(len(results), 1),
+        'requests_per_second': len(results) / elapsed,
+        'rows_per_second': scored_rows / elapsed,
+        'p50_ms': percentile(latencies, 50),
+        'p95_ms': percentile(latencies, 95),
+        'p99_ms': percentile(latencies, 99),
+        'concurrency': concurrency,
+        'batch_sizes': batch_sizes}
+
+
+def check_slo(report, p95_ms=None, p99_ms=None, error_rate=None,
+              rows_per_second=None):
+    violations = []
+    if error_rate is not None and report['error_rate'] > error_rate:
+        violations.append('error rate {:.4f} > {}'.format(
+            report['error_rate'], error_rate))
+    for name, limit in (('p95_ms', p95_ms), ('p99_ms', p99_ms)):
+        if limit is None:
+            continue
+        if report[name] is None or report[name] > limit:
+            violations.append('{} {} > {}'.format(name, report[name], limit))
+    if rows_per_second is not None and \
+            report['rows_per_second'] < rows_per_second:
+        violations.append('rows per second {:.0f} < {}'.format(
+            report['rows_per_second'], rows_per_second))
+    return violations
+
+
 if __name__ == '__main__':
     ret = main()
     exit(ret)
@@ -50,7 +50,8 @@ def main():
 def create_automl_pipeline(ws, ds, compute_target,
                            training_data_file, automl_settings):
     tabular_train_dataset = Dataset.Tabular.from_delimited_files(
-        path=[(ds, os.path.join('train', training_data_file))])
+        path=[(ds, os.path.join('train', training_data_file))]
+    ).drop_columns(amlutils.non_feature_columns)
 
     automl_config = build_automl_config(
         False, automl_settings, tabular_train_dataset, compute_target)
@@ -5,6 +5,10 @@ from azureml.core.model import Model
 from azureml.core.webservice import AksWebservice, Webservice
 from datetime import datetime, timedelta
 
+# columns of the processed training data that aren't model features,
+# data prep writes the month index for time aware cross validation
+non_feature_columns = ['month_index']
+
 
 def setup_azureml():
     """
@@ -54,18 +58,22 @@ def create_azureml_env(ws, env_name, conda_yml):
     return amlenv
 
 
-def register_model(run, datastore, data_folder, model_name):
+def register_model(run, datastore, data_folder, model_name,
+                   model_path=os.path.join('outputs', 'model')):
     """
     register a model from a run and the training dataset with the model
     so that we can do data drift detection later. Assumes model
-    file is uploaded to the outputs folder in AML
+    files are uploaded to the outputs/model folder in AML. Only the csv
+    copy of the training data is registered, the data folder may also
+    contain partitioned parquet files used for training.
     """
     tabular_train_dataset = Dataset.Tabular.from_delimited_files(
-        path=[(datastore, data_folder)])
+        path=[(datastore, os.path.join(data_folder, '**/*.csv'))]
+    ).drop_columns(non_feature_columns)
 
     # model already keeps run info, no need to tag it
     model = run.register_model(
-        model_path=os.path.join('outputs', model_name),
+        model_path=model_path,
         model_name=model_name,
         datasets=[(Dataset.Scenario.TRAINING, tabular_train_dataset)])
 
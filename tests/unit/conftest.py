@@ -0,0 +1,67 @@
+import os
+import sys
+import numpy as np
+import pandas as pd
+import lightgbm as lgb
+import pytest
+
+sys.path.append(os.path.join(os.getcwd(), 'code'))
+import utils  # noqa: E402
+
+
+def make_train_data(n_rows, seed=0):
+    """
+    Processed training data as data prep writes it, for 2015, with a
+    duration that depends on the trip distance and the hour of day.
+    """
+    rng = np.random.RandomState(seed)
+    distance = rng.uniform(0.25, 20, n_rows)
+    hour = rng.randint(0, 24, n_rows)
+    month = rng.randint(1, 13, n_rows)
+    duration = distance * 3 + (hour > 15) * 5 + rng.uniform(0, 2, n_rows)
+    df = pd.DataFrame({
+        'vendorID': rng.randint(1, 3, n_rows),
+        'passengerCount': rng.randint(1, 7, n_rows),
+        'tripDistance': distance,
+        'pickupLongitude': rng.uniform(-74.0, -73.8, n_rows),
+        'pickupLatitude': rng.uniform(40.6, 40.8, n_rows),
+        'dropoffLongitude': rng.uniform(-74.0, -73.8, n_rows),
+        'dropoffLatitude': rng.uniform(40.6, 40.8, n_rows),
+        'totalAmount': 3 + distance * 2.5,
+        'month_num': month,
+        'day_of_month': rng.randint(1, 29, n_rows),
+        'day_of_week': rng.randint(0, 7, n_rows),
+        'hour_of_day': hour,
+        'duration': duration,
+        utils.month_index_column: 2015 * 12 + month},
+        columns=utils.train_columns + [utils.month_index_column])
+    return utils.downcast_train_data(df)
+
+
+def train_small_model(df, num_boost_round=5):
+    """
+    Train a small lightgbm model of the duration on the model features.
+    Returns the model and its feature matrix.
+    """
+    x = utils.feature_matrix(df, utils.feature_columns)
+    dataset = lgb.Dataset(x, label=df[utils.label_column].values,
+                          params={'verbose': -1})
+    model = lgb.train({'objective': 'regression', 'verbose': -1}, dataset,
+                      num_boost_round=num_boost_round)
+    return model, x
+
+
+@pytest.fixture
+def train_data():
+    """
+    Factory of synthetic training data, call it with the number of rows.
+    """
+    return make_train_data
+
+
+@pytest.fixture
+def small_model():
+    """
+    Factory of a small model trained on the given training data.
+    """
+    return train_small_model
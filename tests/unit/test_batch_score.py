@@ -0,0 +1,56 @@
+import os
+import sys
+import glob
+import numpy as np
+import pandas as pd
+import pytest
+
+sys.path.append(os.path.join(os.getcwd(), 'code'))
+# batch_score.py logs to the azureml run context
+pytest.importorskip('azureml.core')
+import utils  # noqa: E402
+import model_io  # noqa: E402
+import batch_score  # noqa: E402
+
+
+def test_score_chunk(train_data, small_model):
+    df = train_data(100)
+    model, x = small_model(df)
+    scored = batch_score.score_chunk(df, model)
+    assert np.allclose(scored[batch_score.prediction_column],
+                       model.predict(x)), \
+        "predictions should be of the model's feature columns"
+    assert list(scored.columns[:-1]) == list(df.columns), \
+        "the processed columns should be kept"
+
+
+@pytest.mark.parametrize('file_format', ['csv', 'parquet'])
+def test_batch_score_replaces_predictions(tmp_path, file_format,
+                                          train_data, small_model):
+    df = train_data(300)
+    model, x = small_model(df)
+    model_folder = str(tmp_path / 'model')
+    model_io.export_model(model, model_folder)
+    data_folder = str(tmp_path / 'data')
+    utils.write_train_data(df, data_folder, 'train.csv')
+    output_folder = str(tmp_path / 'predictions')
+
+    for chunksize in [50, 100]:
+        n_rows = batch_score.batch_score(
+            model_folder, data_folder, output_folder, chunksize=chunksize,
+            file_format=file_format, max_workers=1)
+        assert n_rows == len(df), "every row should be scored"
+
+    if file_format == 'csv':
+        scored = pd.concat(pd.read_csv(f) for f in sorted(
+            glob.glob(os.path.join(output_folder, 'part-*.csv'))))
+    else:
+        scored = utils.read_train_data(output_folder)
+    assert len(scored) == len(df), \
+        "a rerun should replace the predictions of the earlier run"
+    scored = scored.sort_values(batch_score.row_id_column)
+    assert np.array_equal(scored[batch_score.row_id_column],
+                          np.arange(len(df)))
+    assert np.allclose(scored[batch_score.prediction_column],
+                       model.predict(x), atol=1e-4), \
+        "predictions should be in row_id order"
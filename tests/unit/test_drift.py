@@ -0,0 +1,74 @@
+import os
+import sys
+import json
+import numpy as np
+
+sys.path.append(os.path.join(os.getcwd(), 'code'))
+import drift  # noqa: E402
+import utils  # noqa: E402
+
+
+def test_sketches_merge_and_detect_drift():
+    train_data_dir = 'tests/unit/test_data/processed'
+    df = utils.read_train_data(train_data_dir)
+    baseline = drift.sketch_train_data(train_data_dir, chunksize=10)
+    assert baseline.n_rows == len(df), "every row should be sketched"
+
+    half = len(df) // 2
+    merged = drift.FeatureSketches().update(df.iloc[:half]).merge(
+        drift.FeatureSketches().update(df.iloc[half:]))
+    for col in utils.feature_columns:
+        assert np.array_equal(merged.counts[col], baseline.counts[col]), \
+            "merged sketches should equal the sketch of all rows"
+
+    result = drift.detect_drift(baseline, merged)
+    assert not result['drift'] and result['drift_coefficient'] == 0
+
+    shifted = df.assign(hour_of_day=(df.hour_of_day + 12) % 24)
+    result = drift.detect_drift(
+        baseline, drift.FeatureSketches().update(shifted))
+    assert result['drift'], "shifted hours should drift"
+    assert result['drifted_features'] == ['hour_of_day']
+
+
+def test_update_from_collected_reads_only_new_inputs(tmp_path):
+    row = [1, 1, 1.0, -73.957909, 40.670761, -73.952194, 40.662312,
+           8.15, 1, 17, 5, 1]
+    inputs_file = tmp_path / 'greentaxi_inputs_1.jsonl'
+    with open(str(inputs_file), 'w') as f:
+        f.write(json.dumps([row, row]) + '\n')
+    sketch_file = str(tmp_path / 'sketch.json')
+
+    sketch = drift.FeatureSketches()
+    assert drift.update_from_collected(sketch, str(tmp_path)) == 2
+    sketch.save(sketch_file)
+
+    with open(str(inputs_file), 'a') as f:
+        f.write(json.dumps([row]) + '\n')
+    sketch = drift.FeatureSketches.load(sketch_file)
+    assert drift.update_from_collected(sketch, str(tmp_path)) == 1, \
+        "rows added before the last update should not be read again"
+    assert sketch.n_rows == 3
+
+
+def test_update_from_collected_reads_data_collector_csv(tmp_path):
+    row = '1,1,1.0,-73.957909,40.670761,-73.952194,40.662312,8.15,1,17,5,1'
+    header = ','.join(['$aml_dc_correlation_id'] + utils.feature_columns)
+    folder = tmp_path / 'greentaxi' / '1' / 'inputs' / '2020' / '01' / '02'
+    folder.mkdir(parents=True)
+    inputs_file = folder / 'data.csv'
+    # the last line is still being written
+    inputs_file.write_text('{}\na,{}\nb,{}\nc,1,1'.format(header, row, row))
+    (tmp_path / 'greentaxi' / '1' / 'predictions').mkdir()
+    (tmp_path / 'greentaxi' / '1' / 'predictions' / 'data.csv').write_text(
+        'prediction\n10.0\n')
+
+    sketch = drift.FeatureSketches()
+    assert drift.update_from_collected(sketch, str(tmp_path)) == 2, \
+        "complete rows of the collected inputs should be read"
+
+    with open(str(inputs_file), 'a') as f:
+        f.write(row[3:] + '\nd,' + row + '\n')
+    assert drift.update_from_collected(sketch, str(tmp_path)) == 2, \
+        "only rows completed since the last update should be read"
+    assert sketch.n_rows == 4
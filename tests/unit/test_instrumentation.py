@@ -0,0 +1,28 @@
+import os
+import sys
+import json
+
+sys.path.append(os.path.join(os.getcwd(), 'code'))
+import instrumentation  # noqa: E402
+
+
+def test_stages_write_a_report_without_a_run(tmp_path):
+    report_path = str(tmp_path / 'stages.json')
+    stages = instrumentation.Stages(None, report_path=report_path)
+    with stages.stage('read') as stage:
+        rows = list(range(1000))
+        stage.rows = len(rows)
+
+    @stages.timed('total', count_rows=len)
+    def total(rows):
+        return [sum(rows)]
+
+    assert total(rows) == [499500]
+    with open(report_path) as f:
+        report = json.load(f)
+    assert [stage['stage'] for stage in report] == ['read', 'total'], \
+        "every stage should be in the report"
+    assert report[0]['rows'] == 1000 and report[1]['rows'] == 1
+    for stage in report:
+        assert stage['wall_seconds'] >= 0 and stage['cpu_seconds'] >= 0
+        assert stage['peak_rss_mb'] > 0 and stage['rows_per_second'] > 0
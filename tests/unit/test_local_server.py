@@ -0,0 +1,69 @@
+import os
+import sys
+import json
+import threading
+import urllib.request
+
+sys.path.append(os.path.join(os.getcwd(), 'code'))
+import local_server  # noqa: E402
+
+ENTRY_SCRIPT = '''
+import json
+from azureml.core.model import Model
+from azureml.monitoring import ModelDataCollector
+
+
+def init():
+    global model_path, collector
+    model_path = Model.get_model_path('greentaxi')
+    collector = ModelDataCollector('greentaxi', designation='inputs')
+
+
+def run(raw_data):
+    data = json.loads(raw_data)['data']
+    collector.collect(data)
+    return [model_path, len(data)]
+'''
+
+
+def isolate_stand_ins(monkeypatch):
+    """
+    Undo what install_azureml_stand_ins and load_entry_script change
+    when the test ends, so the stand-ins don't leak into other tests.
+    """
+    for name in ['azureml', 'azureml.core', 'azureml.core.model',
+                 'azureml.monitoring']:
+        monkeypatch.setitem(sys.modules, name, sys.modules.get(name))
+    monkeypatch.setattr(local_server.LocalModel, 'model_paths', {})
+    monkeypatch.setattr(local_server.LocalModel, 'default_path', None)
+    monkeypatch.setattr(local_server.LocalDataCollector, 'folder', None)
+    monkeypatch.setattr(sys, 'path', list(sys.path))
+
+
+def test_local_server_scores_with_stand_ins(tmp_path, monkeypatch):
+    isolate_stand_ins(monkeypatch)
+    entry_script_path = str(tmp_path / 'entry.py')
+    with open(entry_script_path, 'w') as f:
+        f.write(ENTRY_SCRIPT)
+    collect_folder = str(tmp_path / 'collected')
+    local_server.install_azureml_stand_ins(
+        [('greentaxi', 'models/greentaxi')], None, collect_folder)
+    entry_script = local_server.load_entry_script(entry_script_path)
+    server = local_server.ThreadedHTTPServer(
+        ('127.0.0.1', 0), local_server.make_handler(entry_script.run))
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    try:
+        request = urllib.request.Request(
+            'http://127.0.0.1:{}/score'.format(server.server_address[1]),
+            data=json.dumps({'data': [[1, 2], [3, 4]]}).encode('utf-8'),
+            headers={'Content-Type': 'application/json'})
+        with urllib.request.urlopen(request) as response:
+            result = json.loads(response.read().decode('utf-8'))
+    finally:
+        server.shutdown()
+        server.server_close()
+
+    assert result == ['models/greentaxi', 2], \
+        "the entry script should run with the local model path"
+    collected = os.listdir(collect_folder)
+    assert len(collected) == 1, "inputs should be collected locally"
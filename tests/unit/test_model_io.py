@@ -0,0 +1,52 @@
+import os
+import sys
+import numpy as np
+from sklearn.pipeline import Pipeline
+from sklearn.preprocessing import StandardScaler
+
+sys.path.append(os.path.join(os.getcwd(), 'code'))
+import consts  # noqa: E402
+import model_io  # noqa: E402
+
+
+def test_export_and_load_model(tmp_path, train_data, small_model):
+    model, x = small_model(train_data(200))
+    model_files = model_io.export_model(model, str(tmp_path))
+    assert [os.path.basename(f) for f in model_files] == [
+        consts.model_name, consts.model_native_file_name], \
+        "pickled and text models should be exported"
+    native = model_io.load_model(str(tmp_path))
+    assert np.allclose(native.predict(x), model.predict(x)), \
+        "text model should predict like the trained model"
+    pickled = model_io.load_model(model_files[0])
+    assert np.allclose(pickled.predict(x), model.predict(x)), \
+        "a single pickled model file should still load"
+
+
+class Wrapper:
+    def __init__(self, model):
+        self.model = model
+
+    def fit(self, x, y):
+        return self
+
+
+def test_native_explainer(train_data, small_model):
+    model, x = small_model(train_data(200))
+    explain = model_io.native_explainer(model)
+    contributions = explain(x)
+    assert contributions.shape == x.shape, \
+        "every feature of every row should get a contribution"
+    expected_value = model.predict(x, pred_contrib=True)[:, -1]
+    assert np.allclose(contributions.sum(axis=1) + expected_value,
+                       model.predict(x)), \
+        "contributions should add up to the prediction"
+
+    # like automl, a pipeline with the lightgbm model wrapped in its last step
+    scaler = StandardScaler().fit(x)
+    pipeline = Pipeline([('scale', scaler), ('model', Wrapper(model))])
+    assert np.allclose(model_io.native_explainer(pipeline)(x),
+                       model.predict(scaler.transform(x), pred_contrib=True)
+                       [:, :-1]), \
+        "a pipeline should be explained after its transforms"
+    assert model_io.native_explainer(StandardScaler()) is None
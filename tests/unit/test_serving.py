@@ -0,0 +1,155 @@
+import os
+import sys
+import json
+import time
+import threading
+import numpy as np
+import pytest
+
+sys.path.append(os.path.join(os.getcwd(), 'code'))
+import serving  # noqa: E402
+
+
+def test_micro_batcher_coalesces_concurrent_requests():
+    batch_sizes = []
+
+    def predict(x):
+        batch_sizes.append(len(x))
+        return x[:, 0] * 2
+
+    batcher = serving.MicroBatcher(predict, max_batch_rows=8,
+                                   max_wait_ms=200)
+    results = {}
+
+    def request(i):
+        results[i] = batcher.predict(np.array([[i, 0.0]]))
+
+    threads = [threading.Thread(target=request, args=(i,)) for i in range(8)]
+    for t in threads:
+        t.start()
+    for t in threads:
+        t.join()
+    batcher.close()
+
+    assert all(results[i].tolist() == [i * 2] for i in range(8)), \
+        "every request should get the predictions of its own rows"
+    assert len(batch_sizes) < 8, "concurrent requests should be batched"
+    metrics = batcher.metrics()
+    assert metrics['requests'] == 8 and metrics['rows'] == 8
+    assert metrics['batches'] == len(batch_sizes)
+
+
+def test_micro_batcher_raises_predict_errors():
+    def predict(x):
+        raise ValueError('bad input')
+
+    batcher = serving.MicroBatcher(predict, max_wait_ms=1)
+    try:
+        batcher.predict(np.zeros((1, 2)))
+        assert False, "predict errors should be raised to the caller"
+    except ValueError as e:
+        assert str(e) == 'bad input'
+    finally:
+        batcher.close()
+
+
+class StubCollector:
+    def __init__(self, delay=0.0):
+        self.delay = delay
+        self.calls = []
+
+    def collect(self, data):
+        time.sleep(self.delay)
+        self.calls.append(data)
+
+
+def test_async_collector_flushes_in_batches():
+    stub = StubCollector()
+    collector = serving.AsyncCollector(stub, batch_size=10,
+                                       flush_interval_ms=200)
+    for i in range(10):
+        collector.collect(np.array([[i, i]]))
+    collector.collect('error')
+    collector.flush()
+    collector.close()
+
+    rows = np.concatenate([c for c in stub.calls if not isinstance(c, str)])
+    assert rows[:, 0].tolist() == list(range(10)), \
+        "every record should reach the collector in order"
+    assert [c for c in stub.calls if isinstance(c, str)] == ['error']
+    assert len(stub.calls) < 11, "records should be collected in batches"
+    metrics = collector.metrics()
+    assert metrics['collected'] == 11 and metrics['flushed'] == 11
+    assert metrics['dropped'] == 0
+
+
+def test_async_collector_drops_when_full():
+    stub = StubCollector(delay=0.2)
+    collector = serving.AsyncCollector(stub, max_queue=2, batch_size=1,
+                                       policy='drop')
+    accepted = [collector.collect(np.zeros((1, 2))) for _ in range(20)]
+    collector.flush()
+    collector.close()
+
+    metrics = collector.metrics()
+    assert not all(accepted), "a full queue should drop records"
+    assert metrics['dropped'] == accepted.count(False)
+    assert metrics['flushed'] == accepted.count(True)
+
+
+def test_parse_features_json():
+    row = [1, 1, 1.0, -73.957909, 40.670761, -73.952194, 40.662312,
+           8.15, 1, 17, 5, 1]
+    expected = np.array([row, row], dtype=np.float32)
+    for raw_data in (json.dumps({'data': [row, row]}),
+                     json.dumps({'data': [row, row]}, indent=2),
+                     json.dumps({'data': [row, row]}).encode('utf-8')):
+        data = serving.parse_features_json(raw_data)
+        assert data.dtype == np.float32
+        assert np.array_equal(data, expected), \
+            "request rows should be parsed into the feature array"
+
+    for raw_data in (json.dumps({'data': [row[:-1]]}),
+                     json.dumps({'rows': [row]}),
+                     json.dumps({'data': [row[:3] + [-80.0] + row[4:]]}),
+                     json.dumps({'data': [row[:-1] + ['x']]}),
+                     json.dumps({'data': [row]})[:-3] + 'x]]}'):
+        with pytest.raises(ValueError):
+            serving.parse_features_json(raw_data)
+
+    data = serving.parse_features_json(
+        json.dumps({'data': [row[:-1] + [None]]}))
+    assert np.isnan(data[0, -1]), \
+        "a null value should be missing rather than scored as -1"
+
+
+def test_prediction_cache():
+    predicted = []
+
+    def predict(x):
+        predicted.append(len(x))
+        return x[:, 2] * 2
+
+    row = [1, 1, 1.0, -73.957909, 40.670761, -73.952194, 40.662312,
+           8.15, 1, 17, 5, 1]
+    nearby = row[:3] + [-73.95791] + row[4:]
+    other = row[:2] + [3.0] + row[3:]
+    cache = serving.PredictionCache(predict, max_entries=2, precision=4)
+    assert cache.predict(np.array([row, other])).tolist() == [2.0, 6.0]
+    assert cache.predict(np.array([nearby])).tolist() == [2.0]
+    assert predicted == [2], \
+        "rows that round to a cached trip should not be predicted"
+
+    third = row[:2] + [5.0] + row[3:]
+    cache.predict(np.array([third]))
+    cache.predict(np.array([other]))
+    metrics = cache.metrics()
+    assert predicted == [2, 1, 1], \
+        "the least recently used row should have been evicted"
+    assert metrics['hits'] == 1 and metrics['misses'] == 4
+    assert metrics['evictions'] == 2 and metrics['entries'] == 2
+
+    expiring = serving.PredictionCache(predict, ttl_seconds=0)
+    expiring.predict(np.array([row]))
+    expiring.predict(np.array([row]))
+    assert expiring.metrics()['expirations'] == 1
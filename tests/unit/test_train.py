@@ -0,0 +1,172 @@
+import os
+import sys
+import numpy as np
+import pytest
+from sklearn.model_selection import train_test_split
+
+sys.path.append(os.path.join(os.getcwd(), 'code'))
+# train.py logs to the azureml run context
+pytest.importorskip('azureml.core')
+import utils  # noqa: E402
+import train  # noqa: E402
+
+
+def test_split_data(train_data):
+    df = train_data(1000)
+    x, y, feature_names, train_idx, test_idx = train.split_data(df)
+    assert feature_names == utils.feature_columns, \
+        "the features should be the training columns but the label"
+    assert x.dtype == np.float32 and x.flags['F_CONTIGUOUS']
+    assert np.array_equal(x[:, 2], df.tripDistance.values)
+    expected_train, expected_test = train_test_split(
+        np.arange(len(df)), test_size=0.2, random_state=223)
+    assert np.array_equal(train_idx, expected_train) and \
+        np.array_equal(test_idx, expected_test), \
+        "the split should match train_test_split"
+
+
+def test_dataset_cache(tmp_path, train_data):
+    data_folder = tmp_path / 'data'
+    cache_dir = str(tmp_path / 'cache')
+    df = train_data(1000)
+    utils.write_train_data(df, str(data_folder), 'train.csv')
+    x, y, feature_names, train_idx, test_idx = train.split_data(df)
+
+    binary_path = train.dataset_cache_path(
+        cache_dir, str(data_folder), feature_names)
+    assert not os.path.isfile(binary_path), "the first run should miss"
+    dataset = train.build_dataset(x, y, feature_names, binary_path)
+    assert os.path.isfile(binary_path), "the dataset should be cached"
+    assert train.dataset_cache_path(
+        cache_dir, str(data_folder), feature_names) == binary_path, \
+        "the same data and features should hit the cache"
+    cached = train.build_dataset(x, y, feature_names, binary_path)
+    assert cached.num_data() == dataset.num_data()
+
+    _, rmse, _ = train.train_model(dataset, x, y, train_idx, test_idx)
+    assert rmse < df.duration.std(), \
+        "the model should be better than predicting the mean"
+    _, cached_rmse, _ = train.train_model(
+        cached, x, y, train_idx, test_idx)
+    assert np.isclose(cached_rmse, rmse), \
+        "the cached dataset should train the same model"
+
+    assert train.dataset_cache_path(
+        cache_dir, str(data_folder), feature_names[:-1]) != binary_path, \
+        "other features should miss the cache"
+    utils.write_train_data(df.iloc[:500], str(data_folder), 'train.csv')
+    assert train.dataset_cache_path(
+        cache_dir, str(data_folder), feature_names,
+        max_cached=0) != binary_path, "changed data should miss the cache"
+    assert not os.path.isfile(binary_path), \
+        "datasets beyond max_cached should be evicted"
+
+
+def test_search_params(train_data):
+    df = train_data(2000)
+    x, y, feature_names, train_idx, _ = train.split_data(df)
+    dataset = train.build_dataset(x, y, feature_names)
+    train_idx, valid_idx = train.split_validation(train_idx)
+    results, params, num_boost_round = train.search_params(
+        dataset, x, y, train_idx, valid_idx, n_trials=9,
+        max_workers=1, min_rounds=2, max_rounds=18, eta=3)
+    rounds = [result['num_boost_round'] for result in results]
+    assert rounds == [2] * 9 + [6] * 3 + [18], \
+        "successive halving should keep a third of the trials per rung"
+    assert len({result['trial'] for result in results}) == 9
+    assert num_boost_round == 18 and 'num_threads' not in params
+    assert params['num_leaves'] in train.search_space['num_leaves']
+
+
+def test_update_reservoir():
+    rng = np.random.RandomState(0)
+    x = np.arange(1000, dtype=np.float32).reshape(-1, 1)
+    y = np.arange(1000, dtype=np.float32)
+    reservoir = {'capacity': 100, 'x': x[:0], 'y': y[:0]}
+    seen = 0
+    for start in range(0, 1000, 37):
+        seen = train._update_reservoir(
+            reservoir, seen, x[start:start + 37], y[start:start + 37], rng)
+    assert seen == 1000, "every row should be counted as seen"
+    assert len(reservoir['y']) == 100, "the reservoir should be full"
+    assert len(np.unique(reservoir['y'])) == 100, \
+        "every row should be sampled at most once"
+    assert np.array_equal(reservoir['x'][:, 0], reservoir['y']), \
+        "features and label should be sampled together"
+    assert reservoir['y'].max() >= 500, \
+        "later rows should replace earlier ones"
+
+    small = {'capacity': 100, 'x': x[:0], 'y': y[:0]}
+    train._update_reservoir(small, 0, x[:30], y[:30], rng)
+    assert np.array_equal(small['y'], y[:30]), \
+        "a stream smaller than the capacity should be kept whole"
+
+
+def test_train_model_streaming(tmp_path, train_data):
+    df = train_data(2400)
+    df['month_num'] = np.repeat([1, 2, 3, 4], 600).astype(np.int8)
+    utils.write_train_data(df, str(tmp_path), 'train.csv',
+                           file_format='parquet')
+    model, rmse, mape, n_rows = train.train_model_streaming(
+        str(tmp_path), chunksize=1000, rounds_per_chunk=5)
+    assert 0 < n_rows < 2400, "holdout rows should not be trained on"
+    assert model.num_trees() == 15, \
+        "every chunk of chunksize rows should add rounds_per_chunk trees"
+    assert rmse < df.duration.std(), \
+        "the model should be better than predicting the mean"
+
+
+def test_kfold_folds():
+    folds = train.kfold_folds(100, 5)
+    assert len(folds) == 5
+    test_rows = np.concatenate([test_idx for _, test_idx, _ in folds])
+    assert np.array_equal(np.sort(test_rows), np.arange(100)), \
+        "every row should be validated on exactly once"
+    for train_idx, test_idx, _ in folds:
+        assert len(np.intersect1d(train_idx, test_idx)) == 0, \
+            "a fold should not train on its test rows"
+
+
+def test_rolling_month_folds():
+    # november 2015 to february 2016, in shuffled row order
+    month = np.array([2016 * 12 + 2, 2015 * 12 + 11, 2016 * 12 + 1,
+                      2015 * 12 + 12, 2016 * 12 + 1, 2015 * 12 + 11])
+    folds = train.rolling_month_folds(month, n_folds=2)
+    assert [name for _, _, name in folds] == \
+        ['month_2016_01', 'month_2016_02'], \
+        "the last months should be validated on, across the year"
+    train_idx, test_idx, _ = folds[0]
+    assert list(train_idx) == [1, 3, 5] and list(test_idx) == [2, 4], \
+        "january 2016 should be trained on the months of 2015"
+    train_idx, test_idx, _ = train.rolling_month_folds(
+        month, n_folds=1, window=1)[0]
+    assert list(train_idx) == [2, 4] and list(test_idx) == [0], \
+        "the window should limit training to the months before"
+    assert len(train.rolling_month_folds(month, n_folds=5)) == 3, \
+        "every month but the first should be validated on at most once"
+    assert train.rolling_month_folds(month[[2, 4]], n_folds=2) == [], \
+        "a single month should give no folds"
+
+
+def test_cross_validate(train_data):
+    df = train_data(2000)
+    x, y, feature_names = train.to_matrix(df)
+    dataset = train.build_dataset(x, y, feature_names)
+    folds = train.kfold_folds(len(y), 3)
+    results = train.cross_validate(dataset, x, y, folds, max_workers=3)
+    assert [result['fold'] for result in results] == \
+        ['fold_0', 'fold_1', 'fold_2'], "every fold should be evaluated"
+    assert all(result['rmse'] < df.duration.std() for result in results), \
+        "every fold should be better than predicting the mean"
+
+
+def test_split_validation(train_data):
+    df = train_data(1000)
+    _, _, _, train_idx, test_idx = train.split_data(df)
+    search_train_idx, valid_idx = train.split_validation(train_idx)
+    assert len(valid_idx) == len(train_idx) // 5
+    assert np.array_equal(
+        np.sort(np.concatenate([search_train_idx, valid_idx])),
+        np.sort(train_idx)), "the train rows should be split in two"
+    assert len(np.intersect1d(valid_idx, test_idx)) == 0, \
+        "the search should not see the test rows"
@@ -1,6 +1,7 @@
 import os
 import sys
 import numpy as np
+import pandas as pd
 
 sys.path.append(os.path.join(os.getcwd(), 'code'))
 import utils  # noqa: E402
@@ -24,3 +25,234 @@ def test_process_raw_data():
     dfuut = utils.process_raw_data(dfraw)
     dfexpected = utils.read_train_data(train_data_dir)
     np.array_equal(dfuut.values, dfexpected.values)
+
+
+def test_read_raw_data_projected_columns():
+    raw_data_dir = 'tests/unit/test_data/raw'
+    df = utils.read_raw_data(raw_data_dir, usecols=utils.raw_columns_used)
+    assert list(df.columns) == utils.raw_columns_used, \
+        "only the projected columns should be read"
+    assert df.dtypes['pickupLatitude'] == np.float32, \
+        "coordinates should be pinned to float32"
+    assert df.dtypes['vendorID'] == np.float32, \
+        "vendorID can be blank and should be read as float32"
+    assert len(utils.process_raw_data(df)) == 1, \
+        "projected raw data should process the same as the full read"
+
+
+def test_process_raw_data_blank_values(tmp_path):
+    raw_file = 'tests/unit/test_data/raw/test_data.csv'
+    lines = open(raw_file).read().splitlines()
+    # blank the passengerCount of the valid trip, the vendorID of a copy
+    fields = lines[2].split(',')
+    fields[4] = ''
+    lines[2] = ','.join(fields)
+    fields = lines[2].split(',')
+    fields[0], fields[1], fields[4] = '1', '', '5'
+    lines.append(','.join(fields))
+    (tmp_path / 'blank.csv').write_text('\n'.join(lines) + '\n')
+    df = utils.read_raw_data(str(tmp_path))
+    assert len(df) == 3, "rows with blank values should be read"
+    dfuut = utils.process_raw_data(df)
+    assert len(dfuut) == 0, "rows with blank values should be dropped"
+    assert dfuut.dtypes['passengerCount'] == np.int8, \
+        "processed passengerCount should be int8"
+
+
+def test_read_raw_data_multiple_files(tmp_path):
+    raw_file = 'tests/unit/test_data/raw/test_data.csv'
+    for month in ['201501', '201502']:
+        folder = tmp_path / month
+        folder.mkdir()
+        (folder / 'part.csv').write_text(open(raw_file).read())
+    df = utils.read_raw_data(str(tmp_path), max_workers=2)
+    assert len(df) == 4, "records from both files should be read"
+    assert df.dtypes['storeAndFwdFlag'].name == 'category', \
+        "storeAndFwdFlag should stay categorical across files"
+
+
+def test_process_raw_data_in_chunks(tmp_path):
+    raw_data_dir = 'tests/unit/test_data/raw'
+    df = utils.process_raw_data(
+        utils.read_raw_data(raw_data_dir, usecols=utils.raw_columns_used))
+    utils.write_train_data(df, str(tmp_path), 'in_memory.csv')
+    shape = utils.process_raw_data_in_chunks(
+        raw_data_dir, str(tmp_path), 'chunked.csv', chunksize=1)
+    assert shape == df.shape, "chunked shape should match in memory shape"
+    assert (tmp_path / 'chunked.csv').read_text() == \
+        (tmp_path / 'in_memory.csv').read_text(), \
+        "chunked output should be identical to in memory output"
+
+
+def test_train_data_parquet_round_trip(tmp_path):
+    train_data_dir = 'tests/unit/test_data/processed'
+    dfcsv = utils.read_train_data(train_data_dir)
+    utils.write_train_data(dfcsv, str(tmp_path), 'train.csv',
+                           file_format='both')
+    assert (tmp_path / 'train' / 'month_num=1').is_dir(), \
+        "parquet output should be partitioned by month_num"
+    dfuut = utils.read_train_data(str(tmp_path))
+    assert list(dfuut.columns) == list(dfcsv.columns), \
+        "parquet columns should be read back in the csv column order"
+    assert dfuut.dtypes['pickupLatitude'] == np.float32, \
+        "coordinates should be stored as float32"
+    assert np.allclose(dfuut.values, dfcsv.values), \
+        "parquet data should match the csv data"
+    dfprojected = utils.read_train_data(
+        str(tmp_path), columns=['tripDistance', 'month_num'])
+    assert list(dfprojected.columns) == ['tripDistance', 'month_num'], \
+        "only the projected columns should be read"
+
+
+def test_list_train_files_mixed_formats(tmp_path):
+    dfcsv = utils.read_train_data('tests/unit/test_data/processed')
+    utils.write_train_data(dfcsv, str(tmp_path), 'train_201501.csv')
+    utils.write_train_data(dfcsv, str(tmp_path), 'train_201502.csv',
+                           file_format='both')
+    files = [os.path.relpath(f, str(tmp_path))
+             for f in utils.list_train_files(str(tmp_path))]
+    assert 'train_201501.csv' in files, \
+        "csv files without a parquet copy should be read"
+    assert 'train_201502.csv' not in files, \
+        "csv copies of a parquet dataset should not be read"
+    assert len(utils.read_train_data(str(tmp_path))) == 2 * len(dfcsv), \
+        "both files should be read once"
+
+
+def test_process_raw_data_incrementally(tmp_path):
+    raw_file = 'tests/unit/test_data/raw/test_data.csv'
+    raw_dir = tmp_path / 'raw'
+    processed_dir = tmp_path / 'processed'
+    raw_dir.mkdir()
+    (raw_dir / '201501.csv').write_text(open(raw_file).read())
+    n_processed, n_reused, _, _ = utils.process_raw_data_incrementally(
+        str(raw_dir), str(processed_dir))
+    assert (n_processed, n_reused) == (1, 0), \
+        "the first run should process the raw file"
+
+    (raw_dir / '201502.csv').write_text(open(raw_file).read())
+    n_processed, n_reused, _, _ = utils.process_raw_data_incrementally(
+        str(raw_dir), str(processed_dir))
+    assert (n_processed, n_reused) == (1, 1), \
+        "only the new raw file should be processed"
+    assert len(utils.read_train_data(str(processed_dir))) == 2, \
+        "training data should be the union of the manifest partitions"
+
+    (raw_dir / '201501.csv').unlink()
+    _, _, n_removed, _ = utils.process_raw_data_incrementally(
+        str(raw_dir), str(processed_dir))
+    assert n_removed == 1, "the removed raw file should be dropped"
+    assert len(utils.read_train_data(str(processed_dir))) == 1, \
+        "partitions of removed raw files should not be read"
+
+    (raw_dir / '201503.csv').write_text(open(raw_file).read())
+    n_processed, n_reused, _, _ = utils.process_raw_data_incrementally(
+        str(raw_dir), str(processed_dir), file_format='parquet')
+    assert (n_processed, n_reused) == (2, 0), \
+        "partitions written in another format should be rebuilt"
+    assert len(utils.read_train_data(str(processed_dir))) == 2, \
+        "every partition should be read after a format change"
+
+
+def test_process_raw_data_datetime_features():
+    pickup = pd.to_datetime([
+        '2016-02-29 23:59:59', '2015-12-31 00:00:00', '2015-03-01 12:30:00',
+        '2015-01-04 21:36:24', None])
+    dropoff = pickup + pd.to_timedelta([300, -30, 10800, 90, 60], unit='s')
+    n = len(pickup)
+    dfraw = pd.DataFrame({
+        'vendorID': np.full(n, 2, dtype=np.int8),
+        'lpepPickupDatetime': pickup,
+        'lpepDropoffDatetime': dropoff,
+        'passengerCount': np.ones(n, dtype=np.int8),
+        'tripDistance': np.ones(n, dtype=np.float32),
+        'pickupLongitude': np.full(n, -73.95, dtype=np.float32),
+        'pickupLatitude': np.full(n, 40.67, dtype=np.float32),
+        'dropoffLongitude': np.full(n, -73.95, dtype=np.float32),
+        'dropoffLatitude': np.full(n, 40.66, dtype=np.float32),
+        'totalAmount': np.full(n, 8.15, dtype=np.float32)})
+    dfuut = utils.process_raw_data(dfraw)
+    assert list(dfuut.index) == [0, 3], \
+        "negative, too long and missing trips should be filtered out"
+    assert list(dfuut.columns) == (
+        utils.train_columns + [utils.month_index_column]), \
+        "processed data should have the training columns in order"
+    kept = pickup[[0, 3]]
+    assert list(dfuut.month_num) == list(kept.month)
+    assert list(dfuut.day_of_month) == list(kept.day)
+    assert list(dfuut.day_of_week) == list(kept.weekday)
+    assert list(dfuut.hour_of_day) == list(kept.hour)
+    assert list(dfuut.duration) == [5, 1]
+    assert list(dfuut.month_index) == [2016 * 12 + 2, 2015 * 12 + 1], \
+        "month_index should count months across years"
+
+
+def test_build_features_batch():
+    dfraw = utils.read_raw_data('tests/unit/test_data/raw')
+    features = utils.build_features_batch(dfraw)
+    rows = [utils.build_features(s) for _, s in dfraw.iterrows()]
+    for col in features.columns:
+        assert list(features[col]) == [s[col] for s in rows], \
+            "batch and row features should match for {}".format(col)
+
+
+def test_spatial_features():
+    dfraw = utils.read_raw_data('tests/unit/test_data/raw')
+    dfuut = utils.process_raw_data(dfraw, spatial=True)
+    assert list(dfuut.columns) == (
+        utils.feature_columns + utils.spatial_feature_columns +
+        [utils.label_column, utils.month_index_column]), \
+        "spatial features should precede the label"
+    n_cells = utils.grid_cells_per_side ** 2
+    assert dfuut.pickup_cell.between(0, n_cells - 1).all()
+    assert np.allclose(dfuut.haversine_distance, 1.0, atol=0.1), \
+        "straight line distance of the test trip is about a mile"
+    x = dfuut[utils.feature_columns].values
+    xspatial = utils.add_spatial_features_to_matrix(x)
+    assert np.allclose(
+        xspatial, dfuut.drop(columns=[
+            utils.label_column, utils.month_index_column]).values), \
+        "scoring and data prep should build the same spatial features"
+
+
+def test_compact_train_data():
+    dfuut = utils.read_train_data('tests/unit/test_data/processed')
+    for col in dfuut.columns:
+        assert dfuut.dtypes[col] == utils.train_dtypes[col], \
+            "{} should be read as {}".format(col, utils.train_dtypes[col])
+    memory_mb, memory_mb_64bit = utils.memory_usage_mb(dfuut)
+    assert memory_mb < memory_mb_64bit, \
+        "compact data should use less memory than 64 bit columns"
+    dfraw = utils.read_raw_data('tests/unit/test_data/raw')
+    dfprocessed = utils.process_raw_data(dfraw)
+    assert dfprocessed.dtypes.equals(dfuut.dtypes), \
+        "data prep should produce the same compact types"
+
+
+def test_iter_train_data(tmp_path):
+    train_data_dir = 'tests/unit/test_data/processed'
+    dfcsv = utils.read_train_data(train_data_dir)
+    chunks = list(utils.iter_train_data(train_data_dir, chunksize=1))
+    assert sum(len(chunk) for chunk in chunks) == len(dfcsv), \
+        "chunks should cover every training row"
+    utils.write_train_data(dfcsv, str(tmp_path), 'train.csv',
+                           file_format='parquet')
+    chunks = list(utils.iter_train_data(str(tmp_path), chunksize=1))
+    assert list(chunks[0].columns) == list(dfcsv.columns), \
+        "parquet chunks should have the csv column order"
+    assert chunks[0].dtypes.equals(dfcsv.dtypes), \
+        "parquet chunks should have the compact types"
+
+
+def test_iter_train_data_combines_files(tmp_path):
+    dfcsv = utils.read_train_data('tests/unit/test_data/processed')
+    df = dfcsv.iloc[[0] * 15].reset_index(drop=True)
+    df['month_num'] = np.repeat([1, 2, 3], 5).astype(np.int8)
+    # a partition file per month, each smaller than a chunk
+    utils.write_train_data(df, str(tmp_path), 'train.csv',
+                           file_format='parquet')
+    chunks = list(utils.iter_train_data(str(tmp_path), chunksize=4))
+    assert [len(chunk) for chunk in chunks] == [4, 4, 4, 3], \
+        "files should be combined into chunks of chunksize rows"
+    assert sorted(pd.concat(chunks).month_num) == list(df.month_num), \
+        "chunks should cover every training row once"
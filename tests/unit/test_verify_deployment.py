@@ -0,0 +1,46 @@
+import os
+import importlib.util
+import pytest
+
+# the module name starts with a digit, so it's loaded from its path
+pytest.importorskip('requests')
+spec = importlib.util.spec_from_file_location(
+    'verify_deployment',
+    os.path.join(os.getcwd(), 'ml_service', '04_verify_deployment.py'))
+verify_deployment = importlib.util.module_from_spec(spec)
+spec.loader.exec_module(verify_deployment)
+
+
+def test_percentile():
+    values = list(range(1, 101))
+    assert verify_deployment.percentile(values, 50) == 50
+    assert verify_deployment.percentile(values, 95) == 95
+    assert verify_deployment.percentile(values, 100) == 100
+    assert verify_deployment.percentile([10, 20, 30, 40], 50) == 20
+    # nearest rank rounds the rank up, 0.625 of 5 values is rank 4
+    assert verify_deployment.percentile([1, 2, 3, 4, 5], 62.5) == 4
+    assert verify_deployment.percentile([1, 2, 3, 4, 5], 50) == 3
+    assert verify_deployment.percentile([7], 99) == 7
+    assert verify_deployment.percentile([], 95) is None
+
+
+def test_check_slo():
+    report = {'error_rate': 0.0, 'p95_ms': 80.0, 'p99_ms': 150.0,
+              'rows_per_second': 2000.0}
+    assert verify_deployment.check_slo(
+        report, p95_ms=100, p99_ms=200, error_rate=0.01,
+        rows_per_second=1000) == [], "a report within the slo should pass"
+    violations = verify_deployment.check_slo(
+        dict(report, error_rate=0.05, p99_ms=250.0), p95_ms=100,
+        p99_ms=200, error_rate=0.01, rows_per_second=5000)
+    assert len(violations) == 3, \
+        "errors, p99 latency and throughput should be violations"
+    assert verify_deployment.check_slo(
+        dict(report, p95_ms=None), p95_ms=100) != [], \
+        "a load test without successful requests should fail the slo"
+
+
+def test_load_test_without_rows():
+    with pytest.raises(ValueError):
+        verify_deployment.load_test('http://localhost:1/score', None, [],
+                                    1, 0.1, [1])